@@ -1,3 +1,6 @@
+import os
+import struct
+from math import gcd
 import librosa
 import librosa.filters
 import numpy as np
@@ -9,6 +12,86 @@ from Wav2Lip.hparams import hparams as hp
 def load_wav(path, sr):
     return librosa.core.load(path, sr=sr)[0]
 
+# (format tag, bits per sample) -> little-endian sample dtype of a WAV data chunk
+_WAV_DTYPES = {
+    (1, 8): np.dtype(np.uint8),
+    (1, 16): np.dtype('<i2'),
+    (1, 32): np.dtype('<i4'),
+    (3, 32): np.dtype('<f4'),
+}
+
+def pcm_to_float(samples, channels=1):
+    """Scale integer PCM to float32 in [-1, 1) and average interleaved channels to mono."""
+    if samples.dtype == np.uint8:
+        wav = (samples.astype(np.float32) - 128.) * (1. / 128.)
+    elif samples.dtype.kind == 'i':
+        wav = samples.astype(np.float32) * (1. / 2 ** (8 * samples.dtype.itemsize - 1))
+    else:
+        wav = samples.astype(np.float32, copy=False)
+    if channels > 1:
+        wav = wav.reshape(-1, channels).mean(axis=1)
+    return wav
+
+def decode_wav(data):
+    """Parse an in-memory RIFF/WAVE file into (float32 mono samples, sample rate).
+
+    The samples are read straight out of `data` (bytes, bytearray or
+    memoryview); only the float conversion allocates.
+    """
+    data = memoryview(data).cast('B')
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError('Audio buffer is not a RIFF/WAVE file')
+
+    fmt, offset = None, 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4].tobytes()
+        size, = struct.unpack_from('<I', data, offset + 4)
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            tag, channels, rate, _, _, bits = struct.unpack_from('<HHIIHH', data, body)
+            if tag == 0xFFFE:
+                # WAVE_FORMAT_EXTENSIBLE: the sub-format GUID starts with the actual tag
+                tag, = struct.unpack_from('<H', data, body + 24)
+            fmt = (tag, channels, rate, bits)
+        elif chunk_id == b'data':
+            break
+        offset = body + size + (size & 1)
+    else:
+        raise ValueError('WAV buffer has no data chunk')
+    if fmt is None:
+        raise ValueError('WAV data chunk precedes its fmt chunk')
+
+    tag, channels, rate, bits = fmt
+    dtype = _WAV_DTYPES.get((tag, bits))
+    if dtype is None:
+        raise ValueError('Unsupported WAV encoding (format {}, {} bits)'.format(tag, bits))
+    if size == 0 or body + size > len(data):
+        # Streaming writers leave the size unset; take everything that follows
+        size = len(data) - body
+    count = size // (dtype.itemsize * channels) * channels
+    samples = np.frombuffer(data, dtype=dtype, count=count, offset=body)
+    return pcm_to_float(samples, channels), rate
+
+def resample(wav, orig_sr, target_sr):
+    """Polyphase resampling; returns `wav` unchanged when the rates already match."""
+    if orig_sr == target_sr:
+        return wav
+    factor = gcd(orig_sr, target_sr)
+    return signal.resample_poly(wav, target_sr // factor, orig_sr // factor).astype(np.float32)
+
+def load_audio(source, sr):
+    """Mono float32 samples at `sr` from a file path, in-memory WAV bytes or a sample array.
+
+    Arrays are taken to be mono and already sampled at `sr`; integer arrays are
+    scaled like PCM.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return load_wav(source, sr)
+    if isinstance(source, np.ndarray):
+        return pcm_to_float(source)
+    wav, rate = decode_wav(source)
+    return resample(wav, rate, sr)
+
 def save_wav(wav, path, sr):
     wav *= 32767 / max(0.01, np.max(np.abs(wav)))
     #proposed by @dsmiller
@@ -50,6 +133,139 @@ def melspectrogram(wav):
         return _normalize(S)
     return S
 
+def split_mel(mel, fps, mel_step_size=16, pad_tail=True):
+    """Cut a mel spectrogram into the per-frame windows fed to Wav2Lip.
+
+    Window i starts at column int(i * 80 / fps). Full windows are followed by one
+    tail window: the remaining columns zero-padded to `mel_step_size` when
+    `pad_tail`, otherwise the last `mel_step_size` columns. All windows are
+    gathered in a single pass from a strided view, and the result is a
+    contiguous float32 array of shape (N, num_mels, mel_step_size).
+    """
+    num_mels, length = mel.shape
+    mel_idx_multiplier = 80. / fps
+
+    # int(i * multiplier) >= length once i exceeds length / multiplier, so one tail is always included
+    starts = (np.arange(int(length / mel_idx_multiplier) + 2) * mel_idx_multiplier).astype(np.int64)
+    num_full = int(np.searchsorted(starts + mel_step_size, length, side='right'))
+    starts = starts[:num_full + 1]
+    if not pad_tail:
+        starts[-1] = max(0, length - mel_step_size)
+
+    # Padding and the float32 cast share one copy; the windows are views into it
+    padded = np.zeros((num_mels, length + mel_step_size), dtype=np.float32)
+    padded[:, :length] = mel
+    windows = np.lib.stride_tricks.sliding_window_view(padded, mel_step_size, axis=1)
+    return windows.transpose(1, 0, 2)[starts]
+
+class StreamingMel:
+    """Incremental `melspectrogram` + `split_mel` for 16 kHz audio that arrives in chunks.
+
+    `feed` takes int16 PCM (array or little-endian bytes) or float samples and
+    returns the 16-column windows completed so far; `flush` ends the stream and
+    returns the rest, including the padded tail. The preemphasis filter state
+    and the STFT overlap are carried between chunks, so the concatenated output
+    equals `split_mel(melspectrogram(wav), fps)` over the whole waveform.
+    """
+    def __init__(self, fps=25, mel_step_size=16, pad_tail=True):
+        if hp.use_lws:
+            raise ValueError('Streaming mel extraction only implements the librosa STFT (use_lws=False).')
+        self.n_fft = hp.n_fft
+        self.hop_size = get_hop_size()
+        self.mel_idx_multiplier = 80. / fps
+        self.mel_step_size = mel_step_size
+        self.pad_tail = pad_tail
+
+        self._zi = np.zeros(1)                  # preemphasis filter state
+        self._pending_byte = b''                # odd byte left over from a bytes chunk
+        self._samples = np.zeros(self.n_fft // 2)  # emphasized samples, starting with the centering pad
+        self._num_samples = 0
+        self._mel = np.zeros((hp.num_mels, 0))
+        self._mel_offset = 0                    # mel column index of self._mel[:, 0]
+        self._window_index = 0
+        self.finished = False
+
+    def feed(self, chunk):
+        """Add a chunk of samples; returns the list of newly complete mel windows."""
+        if self.finished:
+            raise ValueError('StreamingMel.feed called after flush')
+        wav = self._to_float(chunk)
+        if len(wav) == 0:
+            return []
+        if hp.preemphasize:
+            wav, self._zi = signal.lfilter([1, -hp.preemphasis], [1], wav, zi=self._zi)
+        self._samples = np.concatenate((self._samples, wav))
+        self._num_samples += len(wav)
+        self._add_frames()
+        return self._windows()
+
+    def flush(self):
+        """End the stream; returns the remaining windows (the last one padded or clamped)."""
+        if self.finished:
+            return []
+        self.finished = True
+        # Right half of the centering pad; the total frame count becomes 1 + N // hop_size
+        self._samples = np.concatenate((self._samples, np.zeros(self.n_fft // 2)))
+        self._add_frames()
+        windows = self._windows()
+
+        length = self._mel_offset + self._mel.shape[1]
+        start = int(self._window_index * self.mel_idx_multiplier)
+        if not self.pad_tail:
+            start = max(0, length - self.mel_step_size)
+        tail = np.zeros((hp.num_mels, self.mel_step_size), dtype=np.float32)
+        columns = self._mel[:, start - self._mel_offset:]
+        tail[:, :columns.shape[1]] = columns[:, :self.mel_step_size]
+        windows.append(tail)
+        return windows
+
+    def _to_float(self, chunk):
+        if isinstance(chunk, np.ndarray):
+            return pcm_to_float(chunk)
+        data = self._pending_byte + bytes(chunk)
+        usable = len(data) - len(data) % 2
+        self._pending_byte = data[usable:]
+        return pcm_to_float(np.frombuffer(data, dtype='<i2', count=usable // 2))
+
+    def _add_frames(self):
+        """Turn every STFT frame whose samples have all arrived into mel columns."""
+        num_frames = (len(self._samples) - self.n_fft) // self.hop_size + 1
+        if num_frames <= 0:
+            return
+        used = (num_frames - 1) * self.hop_size + self.n_fft
+        D = librosa.stft(y=self._samples[:used], n_fft=self.n_fft, hop_length=self.hop_size,
+                         win_length=hp.win_size, center=False)
+        S = _amp_to_db(_linear_to_mel(np.abs(D))) - hp.ref_level_db
+        if hp.signal_normalization:
+            S = _normalize(S)
+        self._mel = np.concatenate((self._mel, S), axis=1)
+        self._samples = self._samples[num_frames * self.hop_size:]
+
+    def _windows(self):
+        """Pop the complete windows and drop mel columns no later window needs."""
+        windows = []
+        length = self._mel_offset + self._mel.shape[1]
+        while True:
+            start = int(self._window_index * self.mel_idx_multiplier)
+            if start + self.mel_step_size > length:
+                break
+            column = start - self._mel_offset
+            windows.append(self._mel[:, column:column + self.mel_step_size].astype(np.float32))
+            self._window_index += 1
+        # A clamped tail may reach back up to mel_step_size columns from the end
+        keep_from = min(start, max(0, length - self.mel_step_size)) - self._mel_offset
+        if keep_from > 0:
+            self._mel = self._mel[:, keep_from:]
+            self._mel_offset += keep_from
+        return windows
+
+def stream_mel_windows(chunks, fps=25, mel_step_size=16, pad_tail=True):
+    """Yield mel windows for an iterable of audio chunks as soon as each one is complete."""
+    stream = StreamingMel(fps, mel_step_size, pad_tail)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.flush()
+
 def _lws_processor():
     import lws
     return lws.lws(hp.n_fft, get_hop_size(), fftsize=hp.win_size, mode="speech")
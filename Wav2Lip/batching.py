@@ -0,0 +1,49 @@
+import numpy as np
+import torch
+
+class FaceBatchBuffer:
+    """Reusable uint8 staging buffer for Wav2Lip face batches.
+
+    Each face is written once into the reference half (channels 3:6). The masked
+    half (channels 0:3) only receives the upper rows, so its lower half stays
+    zero without a `.copy()`. `to_tensor` turns the filled rows into normalized
+    float32 with a single torch copy/scale into a device buffer that is reused
+    for every batch. On CUDA the staging buffer is pinned so the upload can run
+    asynchronously.
+    """
+    def __init__(self, batch_size, img_size=96, device='cpu', channels_last=False):
+        self.batch_size = batch_size
+        self.img_size = img_size
+        self.device = torch.device(device)
+        self.channels_last = channels_last
+
+        pin = self.device.type == 'cuda'
+        self.staging = torch.zeros((batch_size, img_size, img_size, 6), dtype=torch.uint8, pin_memory=pin)
+        self.array = self.staging.numpy()  # shares memory with `staging`
+
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.output = torch.empty((batch_size, 6, img_size, img_size), dtype=torch.float32,
+                                  device=self.device).contiguous(memory_format=memory_format)
+
+    def fill(self, index, face):
+        """Write one HxWx3 uint8 face into slot `index`."""
+        half = self.img_size // 2
+        self.array[index, :, :, 3:] = face
+        self.array[index, :half, :, :3] = face[:half]
+
+    def to_tensor(self, count):
+        """Normalized (count, 6, H, W) float32 view of the first `count` slots.
+
+        The view is overwritten by the next call, so consume it before refilling.
+        """
+        faces = self.staging[:count]
+        if self.device.type != 'cpu':
+            faces = faces.to(self.device, non_blocking=True)
+        out = self.output[:count]
+        out.copy_(faces.permute(0, 3, 1, 2))
+        return out.mul_(1. / 255.)
+
+def mel_tensor(mel_batch, device='cpu'):
+    """(B, 1, 80, 16) float32 tensor from mel chunks; no copy for a contiguous float32 array on CPU."""
+    mel_batch = np.ascontiguousarray(mel_batch, dtype=np.float32)
+    return torch.from_numpy(mel_batch).unsqueeze(1).to(device)
@@ -0,0 +1,211 @@
+import io
+import os
+import queue
+import struct
+import shutil
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import cv2
+from scipy.io import wavfile
+
+# x264 settings per preset name; "fast" favours latency, "quality" favours size and detail
+PRESETS = {
+    "fast": ["-preset", "ultrafast", "-tune", "zerolatency", "-crf", "28"],
+    "balanced": ["-preset", "veryfast", "-crf", "23"],
+    "quality": ["-preset", "medium", "-crf", "18"],
+}
+
+def ffmpeg_binary():
+    """Path of the ffmpeg executable (FFMPEG_BINARY or the one on PATH), or None."""
+    return os.getenv("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+def wav_bytes(samples, sr=16000):
+    """Encode float samples in [-1, 1] (or int16) as 16-bit mono WAV bytes."""
+    if samples.dtype != np.int16:
+        samples = (np.clip(samples, -1., 1.) * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sr, samples)
+    return buffer.getvalue()
+
+def _drain(stream, chunks):
+    for chunk in iter(lambda: stream.read(1 << 16), b""):
+        chunks.append(chunk)
+    stream.close()
+
+def _feed(fd, data):
+    with os.fdopen(fd, "wb") as f:
+        try:
+            f.write(data)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early; its error is reported by close()
+
+def read_boxes(stream):
+    """Yield (type, bytes) for each top-level MP4 box read from a binary stream."""
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        if size == 1:
+            extended = stream.read(8)
+            size = struct.unpack(">Q", extended)[0]
+            header += extended
+        body = stream.read(size - len(header))
+        if len(body) < size - len(header):
+            return
+        yield kind.decode("latin-1"), header + body
+
+def _split_fragments(stream, fragments):
+    """Put one moof+mdat pair per item on `fragments`; the first also carries the ftyp/moov init segment."""
+    init, fragment = b"", b""
+    for kind, box in read_boxes(stream):
+        if kind in ("ftyp", "moov") and not fragment:
+            init += box
+        elif kind == "moof":
+            fragment = box
+        elif kind == "mdat" and fragment:
+            fragments.put(init + fragment + box)
+            init, fragment = b"", b""
+        # Trailing index boxes (mfra) are not needed to play the fragments
+    stream.close()
+
+class FFmpegEncoder:
+    """H.264/AAC MP4 encoder fed with raw BGR frames over a pipe to one ffmpeg process.
+
+    Audio (a wav path, WAV bytes or a 16 kHz sample array) is muxed in the
+    same pass; in-memory audio is written to ffmpeg through an extra pipe
+    (fd 3) by a helper thread, so nothing touches the disk. With `output`
+    None the MP4 is fragmented and written to stdout, and `close` returns
+    its bytes; otherwise `close` returns the output path.
+
+    With `fragmented=True` (and `output` None) each fragment is put on the
+    `fragments` queue as soon as ffmpeg writes it, instead of being returned
+    by `close`. `keyframe_interval` fixes the GOP length in frames, so every
+    fragment covers exactly that many frames. The first fragment carries the
+    init segment; concatenated in order, the fragments form one playable MP4.
+    Fragmented output is always tuned for zero latency.
+    """
+    def __init__(self, output, frame_size, fps=25, audio=None, preset="balanced", fragmented=False,
+                 keyframe_interval=None):
+        binary = ffmpeg_binary()
+        if binary is None:
+            raise FileNotFoundError("ffmpeg not found; set FFMPEG_BINARY or install ffmpeg.")
+        if preset not in PRESETS:
+            raise ValueError("Unknown encoder preset {!r}; choose from {}.".format(preset, ", ".join(PRESETS)))
+
+        self.output = output
+        frame_w, frame_h = frame_size
+        command = [binary, "-hide_banner", "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", "{}x{}".format(frame_w, frame_h),
+                   "-r", str(fps), "-i", "pipe:0"]
+
+        audio_data, pass_fds, read_fd = None, (), None
+        if isinstance(audio, (str, os.PathLike)):
+            command += ["-i", os.fspath(audio)]
+        elif audio is not None:
+            audio_data = wav_bytes(audio) if isinstance(audio, np.ndarray) else bytes(audio)
+            read_fd, write_fd = os.pipe()
+            os.set_inheritable(read_fd, True)
+            command += ["-f", "wav", "-i", "pipe:{}".format(read_fd)]
+            pass_fds = (read_fd,)
+
+        # yuv420p needs even dimensions
+        command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-pix_fmt", "yuv420p"]
+        command += PRESETS[preset]
+        if fragmented and "-tune" not in PRESETS[preset]:
+            # Without lookahead and frame threads every frame leaves x264 as soon as it is written
+            command += ["-tune", "zerolatency"]
+        if keyframe_interval is not None:
+            command += ["-g", str(keyframe_interval), "-sc_threshold", "0"]
+        if audio is not None:
+            command += ["-c:a", "aac", "-b:a", "64k"]
+        if output is None:
+            command += ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", "pipe:1"]
+        else:
+            command += ["-movflags", "+faststart", output]
+
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE if output is None else subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE, pass_fds=pass_fds)
+        self._threads = []
+        self._stdout, self._stderr = [], []
+        self.fragments = queue.Queue() if fragmented else None
+        if read_fd is not None:
+            os.close(read_fd)
+            self._start(_feed, write_fd, audio_data)
+        if fragmented:
+            self._start(_split_fragments, self.process.stdout, self.fragments)
+        elif output is None:
+            self._start(_drain, self.process.stdout, self._stdout)
+        self._start(_drain, self.process.stderr, self._stderr)
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def write(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        for thread in self._threads:
+            thread.join()
+        if self.process.returncode != 0:
+            error = b"".join(self._stderr).decode("utf-8", "replace").strip()
+            raise RuntimeError("ffmpeg exited with code {}: {}".format(self.process.returncode, error[-2000:]))
+        if self.fragments is not None:
+            return None
+        return b"".join(self._stdout) if self.output is None else self.output
+
+    def abort(self):
+        """Stop ffmpeg without finishing the file, e.g. when the caller stops consuming a stream."""
+        self.process.kill()
+        self.process.wait()
+        for thread in self._threads:
+            thread.join()
+
+class OpenCVEncoder:
+    """Fallback silent mp4v writer with the `FFmpegEncoder` interface, used when ffmpeg is missing."""
+    def __init__(self, output, frame_size, fps=25, audio=None, preset=None):
+        self.output = output
+        self.path = output
+        if output is None:
+            fd, self.path = tempfile.mkstemp(suffix=".mp4")
+            os.close(fd)
+        self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"), fps, tuple(frame_size))
+        if not self.writer.isOpened():
+            if output is None:
+                os.remove(self.path)
+            raise RuntimeError("OpenCV could not open {} for writing with the mp4v codec.".format(self.path))
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+        if self.output is not None:
+            return self.output
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        finally:
+            os.remove(self.path)
+
+_warned = False
+
+def open_encoder(output, frame_size, fps=25, audio=None, preset="balanced"):
+    """An `FFmpegEncoder` when ffmpeg is available, otherwise a silent `OpenCVEncoder`."""
+    global _warned
+    if ffmpeg_binary() is not None:
+        return FFmpegEncoder(output, frame_size, fps, audio, preset)
+    if not _warned:
+        print("ffmpeg not found; writing silent mp4v video with OpenCV instead.")
+        _warned = True
+    return OpenCVEncoder(output, frame_size, fps, audio, preset)
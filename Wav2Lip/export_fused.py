@@ -0,0 +1,30 @@
+import argparse
+import torch
+from Wav2Lip.model_registry import load_checkpoint
+from Wav2Lip.models.fused import fuse_wav2lip, max_fused_error
+
+parser = argparse.ArgumentParser(description='Export a Wav2Lip checkpoint as a frozen inference graph with BatchNorm folded into the convolutions')
+
+parser.add_argument('--checkpoint_path', type=str, required=True,
+                    help='Training checkpoint to export')
+parser.add_argument('--outfile', type=str, default='Wav2Lip/checkpoints/wav2lip_gan_fused.pth',
+                    help='Path of the fused checkpoint')
+parser.add_argument('--atol', type=float, default=1e-4,
+                    help='Maximum allowed absolute output difference against the original model')
+
+def main():
+    args = parser.parse_args()
+
+    model = load_checkpoint(args.checkpoint_path, 'cpu')
+    fused = fuse_wav2lip(model)
+
+    error = max_fused_error(model, fused)
+    print('Max absolute difference against the original model: {:.2e}'.format(error))
+    if error > args.atol:
+        raise ValueError('Fused model deviates by {:.2e} (> {:.2e}); not saving.'.format(error, args.atol))
+
+    torch.save({'state_dict': fused.state_dict(), 'fused': True}, args.outfile)
+    print('Fused checkpoint saved to {}'.format(args.outfile))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import time
+import torch
+from Wav2Lip.model_registry import load_checkpoint
+from Wav2Lip.models.fused import fuse_wav2lip
+from Wav2Lip.runtime import EncoderGraph, DecoderGraph, trace_graphs, save_graphs, export_onnx, load_runtime
+
+parser = argparse.ArgumentParser(description='Export Wav2Lip as an ahead-of-time graph (96x96 faces, dynamic batch)')
+
+parser.add_argument('--checkpoint_path', type=str, required=True,
+                    help='Wav2Lip checkpoint to export')
+parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx'],
+                    help='torchscript writes one archive; onnx writes <outfile>.encoder.onnx and <outfile>.decoder.onnx')
+parser.add_argument('--outfile', type=str, default=None,
+                    help='Default: Wav2Lip/checkpoints/wav2lip_gan.pt (torchscript) or wav2lip_gan.onnx (onnx)')
+parser.add_argument('--no_fuse', default=False, action='store_true',
+                    help='Keep BatchNorm layers instead of folding them before export')
+parser.add_argument('--atol', type=float, default=1e-4,
+                    help='Maximum allowed absolute output difference against the eager model')
+
+img_size = 96
+
+def main():
+    args = parser.parse_args()
+    outfile = args.outfile or 'Wav2Lip/checkpoints/wav2lip_gan.{}'.format('pt' if args.format == 'torchscript' else 'onnx')
+
+    model = load_checkpoint(args.checkpoint_path, 'cpu')
+    graph_model = model if args.no_fuse else fuse_wav2lip(model)
+    encoder, decoder = EncoderGraph(graph_model).eval(), DecoderGraph(graph_model).eval()
+
+    face = torch.rand(1, 6, img_size, img_size)
+    mel = torch.randn(4, 1, 80, 16)
+    if args.format == 'torchscript':
+        save_graphs(trace_graphs(encoder, decoder, face, mel), outfile, precision='fp32')
+    else:
+        export_onnx(encoder, decoder, face, mel, outfile)
+
+    # Reload through the server runtime and check a different batch size against eager
+    start = time.perf_counter()
+    runtime = load_runtime(outfile, 'cpu')
+    load_time = time.perf_counter() - start
+
+    mel = torch.randn(7, 1, 80, 16)
+    with torch.no_grad():
+        expected = model.decode(mel, model.encode_face(face))
+        actual = runtime.decode(mel, runtime.encode_face(face))
+    error = (expected - actual).abs().max().item()
+    print('Runtime load time: {:.2f}s; max absolute difference against eager: {:.2e}'.format(load_time, error))
+    if error > args.atol:
+        raise ValueError('Exported graph deviates by {:.2e} (> {:.2e}).'.format(error, args.atol))
+
+    print('Graph exported to {}'.format(outfile))
+
+if __name__ == '__main__':
+    main()
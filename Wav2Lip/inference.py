@@ -1,6 +1,8 @@
 from os import listdir, path
 import numpy as np
-from Wav2Lip.models.wav2lip import Wav2Lip
+from Wav2Lip.model_registry import registry as model_registry
+from Wav2Lip.batching import FaceBatchBuffer, mel_tensor
+from Wav2Lip.encoder import PRESETS, open_encoder
 from . import audio, face_detection
 import scipy, cv2, os, sys, argparse
 import json, subprocess, random, string
@@ -51,6 +53,9 @@ parser.add_argument('--rotate', default=False, action='store_true',
 parser.add_argument('--nosmooth', default=False, action='store_true',
 					help='Prevent smoothing face detections over a short temporal window')
 
+parser.add_argument('--preset', type=str, default='balanced', choices=list(PRESETS),
+					help='H.264 encoder speed/quality trade-off')
+
 
 args = parser.parse_args()
 args.img_size = 96
@@ -108,7 +113,7 @@ def face_detect(images):
 	return results 
 
 def datagen(frames, mels):
-	img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
+	mel_batch, frame_batch, coords_batch = [], [], []
 
 	if args.box[0] == -1:
 		if not args.static:
@@ -120,6 +125,8 @@ def datagen(frames, mels):
 		y1, y2, x1, x2 = args.box
 		face_det_results = [[f[y1: y2, x1:x2], (y1, y2, x1, x2)] for f in frames]
 
+	face_buffer = FaceBatchBuffer(args.wav2lip_batch_size, args.img_size, device)
+
 	for i, m in enumerate(mels):
 		idx = 0 if args.static else i%len(frames)
 		frame_to_save = frames[idx].copy()
@@ -127,58 +134,25 @@ def datagen(frames, mels):
 
 		face = cv2.resize(face, (args.img_size, args.img_size))
 			
-		img_batch.append(face)
+		face_buffer.fill(len(mel_batch), face)
 		mel_batch.append(m)
 		frame_batch.append(frame_to_save)
 		coords_batch.append(coords)
 
-		if len(img_batch) >= args.wav2lip_batch_size:
-			img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
-
-			img_masked = img_batch.copy()
-			img_masked[:, args.img_size//2:] = 0
-
-			img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-			mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
-
-			yield img_batch, mel_batch, frame_batch, coords_batch
-			img_batch, mel_batch, frame_batch, coords_batch = [], [], [], []
-
-	if len(img_batch) > 0:
-		img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
-
-		img_masked = img_batch.copy()
-		img_masked[:, args.img_size//2:] = 0
+		if len(mel_batch) >= args.wav2lip_batch_size:
+			yield face_buffer.to_tensor(len(mel_batch)), mel_tensor(mel_batch, device), frame_batch, coords_batch
+			mel_batch, frame_batch, coords_batch = [], [], []
 
-		img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-		mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
-
-		yield img_batch, mel_batch, frame_batch, coords_batch
+	if len(mel_batch) > 0:
+		yield face_buffer.to_tensor(len(mel_batch)), mel_tensor(mel_batch, device), frame_batch, coords_batch
 
 mel_step_size = 16
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 print('Using {} for inference.'.format(device))
 
-def _load(checkpoint_path):
-	if device == 'cuda':
-		checkpoint = torch.load(checkpoint_path)
-	else:
-		checkpoint = torch.load(checkpoint_path,
-								map_location=lambda storage, loc: storage)
-	return checkpoint
-
 def load_model(path):
-	model = Wav2Lip()
 	print("Load checkpoint from: {}".format(path))
-	checkpoint = _load(path)
-	s = checkpoint["state_dict"]
-	new_s = {}
-	for k, v in s.items():
-		new_s[k.replace('module.', '')] = v
-	model.load_state_dict(new_s)
-
-	model = model.to(device)
-	return model.eval()
+	return model_registry.get(path, device)
 
 def main():
 	if not os.path.isfile(args.face):
@@ -230,16 +204,8 @@ def main():
 	if np.isnan(mel.reshape(-1)).sum() > 0:
 		raise ValueError('Mel contains nan! Using a TTS voice? Add a small epsilon noise to the wav file and try again')
 
-	mel_chunks = []
-	mel_idx_multiplier = 80./fps 
-	i = 0
-	while 1:
-		start_idx = int(i * mel_idx_multiplier)
-		if start_idx + mel_step_size > len(mel[0]):
-			mel_chunks.append(mel[:, len(mel[0]) - mel_step_size:])
-			break
-		mel_chunks.append(mel[:, start_idx : start_idx + mel_step_size])
-		i += 1
+	# The last chunk is the final mel_step_size columns of the spectrogram
+	mel_chunks = audio.split_mel(mel, fps, mel_step_size, pad_tail=False)
 
 	print("Length of mel chunks: {}".format(len(mel_chunks)))
 
@@ -255,14 +221,17 @@ def main():
 			print ("Model loaded")
 
 			frame_h, frame_w = full_frames[0].shape[:-1]
-			out = cv2.VideoWriter('Wav2Lip/temp/result.avi', 
-									cv2.VideoWriter_fourcc(*'DIVX'), fps, (frame_w, frame_h))
-
-		img_batch = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(device)
-		mel_batch = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(device)
+			# Frames are piped straight to ffmpeg, which muxes the audio in the same pass
+			out = open_encoder(args.outfile, (frame_w, frame_h), fps, audio=args.audio, preset=args.preset)
 
 		with torch.no_grad():
-			pred = model(mel_batch, img_batch)
+			if args.static:
+				# Every frame shares the same face, so encode it only once
+				if i == 0:
+					face_feats = model.encode_face(img_batch[:1])
+				pred = model.decode(mel_batch, face_feats)
+			else:
+				pred = model(mel_batch, img_batch)
 
 		pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
 		
@@ -273,10 +242,7 @@ def main():
 			f[y1:y2, x1:x2] = p
 			out.write(f)
 
-	out.release()
-
-	command = 'ffmpeg -y -i {} -i {} -strict -2 -q:v 1 {}'.format(args.audio, 'Wav2Lip/temp/result.avi', args.outfile)
-	subprocess.call(command, shell=platform.system() != 'Windows')
+	out.close()
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,77 @@
+import numpy as np
+import torch
+from Wav2Lip import audio
+from Wav2Lip.hparams import hparams as hp
+
+class MelSpectrogram:
+    """Batched float32 equivalent of `audio.melspectrogram` built on torch.stft.
+
+    Preemphasis, STFT, mel projection, dB conversion and normalization run as
+    torch ops over a whole batch of waveforms in one call. The Hann window and
+    the mel basis are built once per device. Waveforms of different lengths are
+    zero-padded to the longest one and each result is cut back to the frame
+    count librosa would produce for it (centered frames, constant padding).
+    """
+    def __init__(self, device='cpu'):
+        if hp.use_lws:
+            raise ValueError('The torch mel engine only implements the librosa STFT (use_lws=False).')
+        self.device = torch.device(device)
+        self.n_fft = hp.n_fft
+        self.hop_size = audio.get_hop_size()
+        self.win_size = hp.win_size
+        self.window = torch.hann_window(self.win_size, periodic=True, dtype=torch.float32, device=self.device)
+        self.mel_basis = torch.from_numpy(audio._build_mel_basis()).to(self.device, torch.float32)
+        self.min_level = float(np.exp(hp.min_level_db / 20 * np.log(10)))
+
+    def num_frames(self, length):
+        return 1 + length // self.hop_size
+
+    def __call__(self, wavs):
+        """Mel spectrograms for a list of 1-D waveforms; returns float32 (num_mels, T) arrays."""
+        wavs = [np.asarray(wav, dtype=np.float32) for wav in wavs]
+        lengths = [len(wav) for wav in wavs]
+        batch = np.zeros((len(wavs), max(lengths)), dtype=np.float32)
+        for row, wav in zip(batch, wavs):
+            row[:len(wav)] = wav
+        mels = self.forward(torch.from_numpy(batch).to(self.device),
+                            torch.tensor(lengths, device=self.device)).cpu().numpy()
+        return [mel[:, :self.num_frames(length)] for mel, length in zip(mels, lengths)]
+
+    @torch.no_grad()
+    def forward(self, wavs, lengths):
+        """(B, N) zero-padded waveforms -> (B, num_mels, 1 + N // hop_size) normalized mels."""
+        if hp.preemphasize:
+            # y[n] = x[n] - k * x[n - 1]; the padding must stay zero so short rows match librosa
+            emphasized = wavs.clone()
+            emphasized[:, 1:] -= hp.preemphasis * wavs[:, :-1]
+            positions = torch.arange(wavs.shape[1], device=wavs.device)
+            wavs = emphasized.masked_fill_(positions >= lengths[:, None], 0.)
+
+        spec = torch.stft(wavs, self.n_fft, hop_length=self.hop_size, win_length=self.win_size,
+                          window=self.window, center=True, pad_mode='constant', return_complex=True)
+        S = torch.matmul(self.mel_basis, spec.abs())
+        S = 20 * torch.log10(S.clamp_(min=self.min_level)) - hp.ref_level_db
+        if hp.signal_normalization:
+            S = self._normalize(S)
+        return S
+
+    def _normalize(self, S):
+        scale = -hp.min_level_db
+        if hp.symmetric_mels:
+            S = (2 * hp.max_abs_value) * ((S - hp.min_level_db) / scale) - hp.max_abs_value
+            low = -hp.max_abs_value
+        else:
+            S = hp.max_abs_value * ((S - hp.min_level_db) / scale)
+            low = 0
+        if hp.allow_clipping_in_normalization:
+            S = S.clamp_(low, hp.max_abs_value)
+        return S
+
+_engines = {}
+
+def melspectrogram_batch(wavs, device='cpu'):
+    """Mel spectrograms for several waveforms at once with a cached `MelSpectrogram` engine."""
+    engine = _engines.get(str(device))
+    if engine is None:
+        engine = _engines[str(device)] = MelSpectrogram(device)
+    return engine(wavs)
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+import torch
+from Wav2Lip.models.wav2lip import Wav2Lip
+from Wav2Lip.models.fused import fuse_wav2lip
+from Wav2Lip.runtime import load_runtime
+
+
+def load_checkpoint(checkpoint_path, device, fused=False, channels_last=False):
+    """Build a Wav2Lip generator from a checkpoint and move it to `device` in eval mode.
+
+    Checkpoints written by `Wav2Lip.export_fused` are loaded as the fused
+    inference graph; `fused=True` folds BatchNorm into a training checkpoint.
+    `channels_last=True` stores the eager model's weights in NHWC layout.
+    Compiled graphs from `Wav2Lip.export_graph` or `Wav2Lip.quantize` are run
+    through the matching runtime in `Wav2Lip.runtime`.
+    """
+    runtime = load_runtime(checkpoint_path, device)
+    if runtime is not None:
+        return runtime
+
+    model = Wav2Lip()
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+    state_dict = checkpoint["state_dict"]
+    if checkpoint.get("fused"):
+        model = fuse_wav2lip(model)
+        model.load_state_dict(state_dict)
+    else:
+        model.load_state_dict({k.replace("module.", ""): v for k, v in state_dict.items()})
+        if fused:
+            model = fuse_wav2lip(model)
+    model = model.to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model.eval()
+
+
+class ModelRegistry:
+    """Process-wide cache of Wav2Lip models.
+
+    Each (checkpoint, device) pair is loaded once and kept resident, so callers
+    only pay for `torch.load` on the first request. Load time and hit counts are
+    tracked per entry and reported by `stats()`.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(checkpoint_path, device, fused=False, channels_last=False):
+        return os.path.abspath(checkpoint_path), str(device), bool(fused), bool(channels_last)
+
+    def get(self, checkpoint_path, device='cpu', fused=False, channels_last=False):
+        """Return the resident model for `checkpoint_path`, loading it on first use."""
+        key = self._key(checkpoint_path, device, fused, channels_last)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._stats[key]["hits"] += 1
+                return model
+
+            print(f"Loading Wav2Lip model from {checkpoint_path}...")
+            start = time.perf_counter()
+            model = load_checkpoint(checkpoint_path, device, fused, channels_last)
+            load_time = time.perf_counter() - start
+
+            self._models[key] = model
+            self._stats[key] = {
+                "checkpoint_path": key[0],
+                "device": key[1],
+                "fused": getattr(model, "fused", False),
+                "precision": getattr(model, "precision", "fp32"),
+                "channels_last": key[3],
+                "load_time": load_time,
+                "loaded_at": time.time(),
+                "hits": 0,
+            }
+            print(f"Model loaded in {load_time:.2f}s.")
+            return model
+
+    def preload(self, checkpoint_path, device='cpu', fused=False, channels_last=False):
+        """Load a checkpoint ahead of the first request (e.g. at server startup)."""
+        self.get(checkpoint_path, device, fused, channels_last)
+
+    def evict(self, checkpoint_path, device='cpu', fused=False, channels_last=False):
+        key = self._key(checkpoint_path, device, fused, channels_last)
+        with self._lock:
+            self._models.pop(key, None)
+            self._stats.pop(key, None)
+
+    def stats(self):
+        """Return a snapshot of load time and hit count for every resident model."""
+        with self._lock:
+            return [dict(entry) for entry in self._stats.values()]
+
+
+# Shared by router.lip_sync, router.socket_server and Wav2Lip.inference
+registry = ModelRegistry()
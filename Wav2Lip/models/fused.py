@@ -0,0 +1,71 @@
+import copy
+import torch
+from torch import nn
+
+from .conv import Conv2d, Conv2dTranspose
+
+class FusedConv2d(nn.Module):
+    """Inference-only `Conv2d` block: BatchNorm folded into the conv, residual add and ReLU in place."""
+    def __init__(self, conv, residual=False):
+        super().__init__()
+        self.conv = conv
+        self.residual = residual
+
+    def forward(self, x):
+        out = self.conv(x)
+        if self.residual:
+            out.add_(x)
+        return out.relu_()
+
+class FusedConv2dTranspose(nn.Module):
+    """Inference-only `Conv2dTranspose` block with BatchNorm folded into the transposed conv."""
+    def __init__(self, conv):
+        super().__init__()
+        self.conv = conv
+
+    def forward(self, x):
+        return self.conv(x).relu_()
+
+def fold_batchnorm(conv, bn):
+    """Return a copy of `conv` whose weights and bias absorb the eval-mode statistics of `bn`."""
+    fused = copy.deepcopy(conv)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+
+    # Output channels are dim 0 for Conv2d and dim 1 for ConvTranspose2d weights
+    if isinstance(conv, nn.ConvTranspose2d):
+        shape = (1, -1) + (1,) * (conv.weight.dim() - 2)
+    else:
+        shape = (-1,) + (1,) * (conv.weight.dim() - 1)
+
+    fused.weight = nn.Parameter(conv.weight * scale.reshape(shape))
+    fused.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+def _fuse_block(block):
+    conv, bn = block.conv_block
+    if isinstance(block, Conv2dTranspose):
+        return FusedConv2dTranspose(fold_batchnorm(conv, bn))
+    return FusedConv2d(fold_batchnorm(conv, bn), block.residual)
+
+def fuse_wav2lip(model):
+    """Return a frozen, inference-only copy of `model` with every BatchNorm folded away."""
+    fused = copy.deepcopy(model).eval()
+    for parent in list(fused.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, (Conv2d, Conv2dTranspose)):
+                setattr(parent, name, _fuse_block(child))
+
+    for p in fused.parameters():
+        p.requires_grad_(False)
+    fused.fused = True
+    return fused
+
+def max_fused_error(model, fused, batch_size=4, seed=0):
+    """Largest absolute output difference between `model` and `fused` on random inputs."""
+    device = next(model.parameters()).device
+    generator = torch.Generator().manual_seed(seed)
+    mel = torch.randn(batch_size, 1, 80, 16, generator=generator).to(device)
+    face = torch.rand(batch_size, 6, 96, 96, generator=generator).to(device)
+    with torch.no_grad():
+        return (model.eval()(mel, face) - fused(mel, face)).abs().max().item()
@@ -84,36 +84,52 @@ class Wav2Lip(nn.Module):
             nn.Conv2d(32, 3, kernel_size=1, stride=1, padding=0),
             nn.Sigmoid()) 
 
-    def forward(self, audio_sequences, face_sequences):
-        # audio_sequences = (B, T, 1, 80, 16)
-        B = audio_sequences.size(0)
-
-        input_dim_size = len(face_sequences.size())
-        if input_dim_size > 4:
-            audio_sequences = torch.cat([audio_sequences[:, i] for i in range(audio_sequences.size(1))], dim=0)
-            face_sequences = torch.cat([face_sequences[:, :, i] for i in range(face_sequences.size(2))], dim=0)
-
-        audio_embedding = self.audio_encoder(audio_sequences) # B, 512, 1, 1
+    def encode_face(self, face_sequences):
+        """Run the face encoder and return the skip-connection feature pyramid.
 
+        For a still avatar the result only depends on the face, so it can be
+        computed once and reused by `decode` for every mel chunk.
+        """
         feats = []
         x = face_sequences
         for f in self.face_encoder_blocks:
             x = f(x)
             feats.append(x)
+        return feats
+
+    def decode(self, audio_sequences, feats):
+        """Run the audio encoder and face decoder against precomputed `feats`.
+
+        `feats` is the list returned by `encode_face`. It may hold a single face
+        (batch size 1), in which case it is broadcast over the audio batch. The
+        list is not modified.
+        """
+        audio_embedding = self.audio_encoder(audio_sequences) # B, 512, 1, 1
+        B = audio_embedding.size(0)
 
         x = audio_embedding
-        for f in self.face_decoder_blocks:
+        for f, feat in zip(self.face_decoder_blocks, reversed(feats)):
             x = f(x)
             try:
-                x = torch.cat((x, feats[-1]), dim=1)
+                x = torch.cat((x, feat.expand(B, -1, -1, -1)), dim=1)
             except Exception as e:
                 print(x.size())
-                print(feats[-1].size())
+                print(feat.size())
                 raise e
-            
-            feats.pop()
 
-        x = self.output_block(x)
+        return self.output_block(x)
+
+    def forward(self, audio_sequences, face_sequences):
+        # audio_sequences = (B, T, 1, 80, 16)
+        B = audio_sequences.size(0)
+
+        input_dim_size = len(face_sequences.size())
+        if input_dim_size > 4:
+            audio_sequences = torch.cat([audio_sequences[:, i] for i in range(audio_sequences.size(1))], dim=0)
+            face_sequences = torch.cat([face_sequences[:, :, i] for i in range(face_sequences.size(2))], dim=0)
+
+        feats = self.encode_face(face_sequences)
+        x = self.decode(audio_sequences, feats)
 
         if input_dim_size > 4:
             x = torch.split(x, B, dim=0) # [(B, C, H, W)]
@@ -0,0 +1,88 @@
+import argparse
+import numpy as np
+import cv2
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from Wav2Lip import audio
+from Wav2Lip.model_registry import load_checkpoint
+from Wav2Lip.runtime import EncoderGraph, DecoderGraph, trace_graphs, save_graphs
+from router.lip_sync import detect_face_box, FACE_PADS
+
+parser = argparse.ArgumentParser(description='Calibrate Wav2Lip on sample utterances and export an int8 CPU checkpoint')
+
+parser.add_argument('--checkpoint_path', type=str, required=True,
+                    help='fp32 Wav2Lip checkpoint to quantize')
+parser.add_argument('--face', type=str, required=True,
+                    help='Avatar image used for calibration')
+parser.add_argument('--audio', type=str, nargs='+', required=True,
+                    help='One or more .wav utterances used for calibration')
+parser.add_argument('--outfile', type=str, default='Wav2Lip/checkpoints/wav2lip_gan_int8.pt',
+                    help='Path of the int8 TorchScript archive')
+parser.add_argument('--batch_size', type=int, default=16,
+                    help='Mel chunks per calibration batch')
+parser.add_argument('--backend', type=str, default='x86', choices=['x86', 'fbgemm', 'qnnpack', 'onednn'],
+                    help='Quantized kernel backend')
+
+mel_step_size = 16
+img_size = 96
+
+def face_input(image_path):
+    """Read an image as the (1, 6, 96, 96) masked + reference Wav2Lip input.
+
+    Like the server, only the padded face crop is resized, so calibration and
+    benchmarks see the same input distribution as production renders.
+    """
+    frame = cv2.imread(image_path)
+    if frame is None:
+        raise FileNotFoundError('Image file {} not found.'.format(image_path))
+    x1, y1, x2, y2 = detect_face_box(frame, FACE_PADS)
+    face = cv2.resize(frame[y1:y2, x1:x2], (img_size, img_size))
+    masked = face.copy()
+    masked[img_size // 2:] = 0
+    face = np.concatenate((masked, face), axis=2) / 255.
+    return torch.FloatTensor(np.transpose(face, (2, 0, 1))[None])
+
+def mel_batches(audio_paths, batch_size, fps=25.):
+    """Yield (B, 1, 80, 16) mel batches for every utterance in `audio_paths`."""
+    for path in audio_paths:
+        mel = audio.melspectrogram(audio.load_wav(path, 16000))
+        chunks = audio.split_mel(mel, fps, mel_step_size, pad_tail=False)
+        for i in range(0, len(chunks), batch_size):
+            yield torch.from_numpy(chunks[i:i + batch_size]).unsqueeze(1)
+
+def quantize_wav2lip(model, face, calibration_mels, backend='x86'):
+    """Statically quantize the decoder to int8; the encoder stays fp32 (it runs once per avatar).
+
+    Returns the traced encode/decode archive. Convolutions, BatchNorm and the
+    residual add + ReLU are fused by FX and observed on `calibration_mels`.
+    """
+    torch.backends.quantized.engine = backend
+    model = model.cpu().eval()
+    encoder = EncoderGraph(model).eval()
+    with torch.no_grad():
+        feats = encoder(face)
+
+    calibration_mels = list(calibration_mels)
+    example = (calibration_mels[0],) + feats
+    prepared = prepare_fx(DecoderGraph(model).eval(), get_default_qconfig_mapping(backend), example)
+    with torch.no_grad():
+        for mel in calibration_mels:
+            prepared(mel, *feats)
+    decoder = convert_fx(prepared)
+
+    return trace_graphs(encoder, decoder, face, calibration_mels[0])
+
+def main():
+    args = parser.parse_args()
+
+    model = load_checkpoint(args.checkpoint_path, 'cpu')
+    face = face_input(args.face)
+    traced = quantize_wav2lip(model, face, mel_batches(args.audio, args.batch_size), args.backend)
+
+    save_graphs(traced, args.outfile, precision='int8', backend=args.backend)
+    print('int8 checkpoint saved to {}'.format(args.outfile))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import os
+import json
+import zipfile
+import numpy as np
+import torch
+from torch import nn
+
+# Length of the skip-connection pyramid returned by Wav2Lip.encode_face
+NUM_FEATS = 7
+
+class EncoderGraph(nn.Module):
+    """Traceable view of `Wav2Lip.encode_face` that returns a tuple."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, face):
+        return tuple(self.model.encode_face(face))
+
+class DecoderGraph(nn.Module):
+    """Traceable view of `Wav2Lip.decode` taking the feature pyramid as positional tensors."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, mel, f0, f1, f2, f3, f4, f5, f6):
+        return self.model.decode(mel, [f0, f1, f2, f3, f4, f5, f6])
+
+class Wav2LipGraphs(nn.Module):
+    """Pairs an encoder and a decoder graph so both are serialized in one archive."""
+    def __init__(self, encoder, decoder):
+        super().__init__()
+        self.encoder = encoder
+        self.decoder = decoder
+
+    def encode(self, face):
+        return self.encoder(face)
+
+    def decode(self, mel, f0, f1, f2, f3, f4, f5, f6):
+        return self.decoder(mel, f0, f1, f2, f3, f4, f5, f6)
+
+FEAT_NAMES = ["feat_{}".format(i) for i in range(NUM_FEATS)]
+
+def trace_graphs(encoder, decoder, face, mel):
+    """Trace `encode`/`decode` on example inputs; the batch dimension stays dynamic."""
+    graphs = Wav2LipGraphs(encoder, decoder).eval()
+    with torch.no_grad():
+        feats = encoder(face)
+        return torch.jit.trace_module(graphs, {"encode": (face,), "decode": (mel,) + tuple(feats)})
+
+def onnx_paths(path):
+    """Encoder/decoder file names for an ONNX export named `path` (e.g. wav2lip_gan.onnx)."""
+    stem = os.path.splitext(path)[0]
+    return stem + ".encoder.onnx", stem + ".decoder.onnx"
+
+def export_onnx(encoder, decoder, face, mel, path, opset_version=17):
+    """Export encoder and decoder graphs as two ONNX files with a dynamic batch axis."""
+    encoder_path, decoder_path = onnx_paths(path)
+    with torch.no_grad():
+        feats = encoder(face)
+    batch_axis = {0: "batch"}
+    torch.onnx.export(encoder, (face,), encoder_path, input_names=["face"], output_names=FEAT_NAMES,
+                      dynamic_axes={name: batch_axis for name in ["face"] + FEAT_NAMES},
+                      opset_version=opset_version, dynamo=False)
+    # Features may hold one face (broadcast) or one face per mel chunk
+    torch.onnx.export(decoder, (mel,) + tuple(feats), decoder_path, input_names=["mel"] + FEAT_NAMES,
+                      output_names=["frames"],
+                      dynamic_axes=dict({"mel": batch_axis, "frames": batch_axis},
+                                        **{name: {0: "face_batch"} for name in FEAT_NAMES}),
+                      opset_version=opset_version, dynamo=False)
+    return encoder_path, decoder_path
+
+def save_graphs(traced, path, **meta):
+    """Save a traced archive with `meta` (e.g. precision) stored alongside the code."""
+    torch.jit.save(traced, path, _extra_files={"wav2lip.json": json.dumps(meta)})
+
+def is_torchscript_archive(path):
+    """True for archives written by `torch.jit.save` (as opposed to `torch.save` checkpoints)."""
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.endswith("/constants.pkl") for name in archive.namelist())
+
+class TorchScriptWav2Lip:
+    """Runs a traced encode/decode archive behind the same interface as `Wav2Lip`."""
+    def __init__(self, module, meta=None):
+        self.module = module
+        self.meta = meta or {}
+        self.precision = self.meta.get("precision", "fp32")
+
+    @classmethod
+    def load(cls, path, device='cpu', optimize=True):
+        """Load a traced archive; fp32 graphs are frozen and tuned for inference when `optimize`."""
+        extra_files = {"wav2lip.json": ""}
+        module = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        meta = json.loads(extra_files["wav2lip.json"] or "{}")
+        if "backend" in meta:
+            # Packed int8 weights only run on the kernels they were quantized for
+            torch.backends.quantized.engine = meta["backend"]
+        module = module.eval()
+        if optimize and meta.get("precision", "fp32") == "fp32":
+            # Inline the weights as constants, then let the JIT fuse conv/add/relu for the device
+            methods = ["encode", "decode"]
+            module = torch.jit.freeze(module, preserved_attrs=methods)
+            module = torch.jit.optimize_for_inference(module, other_methods=methods)
+        return cls(module, meta)
+
+    def encode_face(self, face_sequences):
+        return list(self.module.encode(face_sequences))
+
+    def decode(self, audio_sequences, feats):
+        return self.module.decode(audio_sequences, *feats)
+
+    def __call__(self, audio_sequences, face_sequences):
+        return self.decode(audio_sequences, self.encode_face(face_sequences))
+
+    def to(self, device):
+        self.module.to(device)
+        return self
+
+    def eval(self):
+        return self
+
+class OnnxWav2Lip:
+    """Runs an ONNX encoder/decoder export with onnxruntime's CPU backend."""
+    precision = "fp32"
+
+    def __init__(self, encoder, decoder):
+        self.encoder = encoder
+        self.decoder = decoder
+
+    @classmethod
+    def load(cls, path, num_threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        encoder_path, decoder_path = onnx_paths(path)
+        return cls(onnxruntime.InferenceSession(encoder_path, options, providers=providers),
+                   onnxruntime.InferenceSession(decoder_path, options, providers=providers))
+
+    def encode_face(self, face_sequences):
+        feats = self.encoder.run(FEAT_NAMES, {"face": face_sequences.cpu().numpy()})
+        return [torch.from_numpy(f) for f in feats]
+
+    def decode(self, audio_sequences, feats):
+        inputs = {"mel": audio_sequences.cpu().numpy()}
+        inputs.update({name: np.ascontiguousarray(f.cpu().numpy()) for name, f in zip(FEAT_NAMES, feats)})
+        return torch.from_numpy(self.decoder.run(["frames"], inputs)[0])
+
+    def __call__(self, audio_sequences, face_sequences):
+        return self.decode(audio_sequences, self.encode_face(face_sequences))
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+def load_runtime(path, device='cpu'):
+    """Load a compiled graph, choosing the runtime from the file type.
+
+    `.onnx` paths run on onnxruntime (CPU); TorchScript archives run on the
+    JIT. Returns None for regular `torch.save` checkpoints.
+    """
+    if path.endswith(".onnx"):
+        return OnnxWav2Lip.load(path, torch.get_num_threads())
+    if is_torchscript_archive(path):
+        return TorchScriptWav2Lip.load(path, device)
+    return None
@@ -0,0 +1,73 @@
+"""Compare the default NCHW execution path with the channels-last (NHWC) path.
+
+Times input assembly plus one Wav2Lip decode per batch, as done per utterance
+by router/lip_sync.py, for several intra-op thread counts. Run it on the
+target CPU SKU to decide whether to set WAV2LIP_CHANNELS_LAST=1 and how many
+LIPSYNC_TORCH_THREADS to give each worker.
+
+    python -m benchmarks.channels_last --checkpoint_path Wav2Lip/checkpoints/wav2lip_gan.pth --threads 1 2 4 8
+"""
+import argparse
+import time
+import numpy as np
+import torch
+
+from Wav2Lip.model_registry import load_checkpoint
+
+parser = argparse.ArgumentParser(description='Benchmark channels-last against NCHW Wav2Lip execution on CPU')
+parser.add_argument('--checkpoint_path', type=str, required=True, help='Wav2Lip checkpoint')
+parser.add_argument('--batch_size', type=int, nargs='+', default=[1, 16, 64], help='Mel chunks per forward pass')
+parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()], help='Intra-op thread counts to try')
+parser.add_argument('--fused', default=False, action='store_true', help='Fold BatchNorm before benchmarking')
+parser.add_argument('--repeats', type=int, default=5, help='Timed runs per configuration; the median is reported')
+
+img_size = 96
+
+
+def nchw_inputs(face, mels):
+    """Current path: float64 normalization, np.transpose and torch.FloatTensor copies."""
+    face = torch.FloatTensor(np.transpose(face / 255., (0, 3, 1, 2)))
+    mels = torch.FloatTensor(np.transpose(mels[..., None], (0, 3, 1, 2)))
+    return face, mels
+
+
+def channels_last_inputs(face, mels):
+    """Channels-last path: permuted views of the NHWC arrays, one float32 copy each."""
+    face = torch.from_numpy(face).permute(0, 3, 1, 2).to(torch.float32, memory_format=torch.channels_last).div_(255.)
+    mels = torch.from_numpy(mels).unsqueeze(1)
+    return face, mels
+
+
+def time_path(model, make_inputs, face, mels, repeats):
+    with torch.no_grad():
+        face_tensor, _ = make_inputs(face, mels)
+        feats = model.encode_face(face_tensor)
+        model.decode(make_inputs(face, mels)[1], feats)  # warm up oneDNN primitives
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model.decode(make_inputs(face, mels)[1], feats)
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main(args):
+    nchw = load_checkpoint(args.checkpoint_path, 'cpu', fused=args.fused)
+    nhwc = load_checkpoint(args.checkpoint_path, 'cpu', fused=args.fused, channels_last=True)
+
+    rng = np.random.default_rng(0)
+    face = rng.integers(0, 256, size=(1, img_size, img_size, 6), dtype=np.uint8).astype(np.float64)
+
+    print('{:>7} {:>6} {:>14} {:>14} {:>8}'.format('threads', 'batch', 'nchw ms/frame', 'nhwc ms/frame', 'speedup'))
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_size:
+            mels = rng.standard_normal((batch_size, 80, 16)).astype(np.float32)
+            base = time_path(nchw, nchw_inputs, face, mels, args.repeats)
+            fast = time_path(nhwc, channels_last_inputs, face.astype(np.uint8), mels, args.repeats)
+            print('{:>7} {:>6} {:>14.2f} {:>14.2f} {:>7.2f}x'.format(
+                threads, batch_size, 1000 * base / batch_size, 1000 * fast / batch_size, base / fast))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+"""Compare fp32 and int8 Wav2Lip decoding on CPU.
+
+Reports decoder throughput, the pixel difference between the two outputs and,
+when a SyncNet expert checkpoint is given, the change in audio/video sync
+confidence.
+
+    python -m benchmarks.int8 --checkpoint_path Wav2Lip/checkpoints/wav2lip_gan.pth \\
+        --int8_checkpoint Wav2Lip/checkpoints/wav2lip_gan_int8.pt \\
+        --face static/faces/es.jpg --audio sample1.wav sample2.wav
+"""
+import argparse
+import time
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from Wav2Lip.models import SyncNet_color
+from Wav2Lip.model_registry import load_checkpoint
+from Wav2Lip.quantize import face_input, mel_batches
+
+parser = argparse.ArgumentParser(description='Benchmark int8 against fp32 Wav2Lip on CPU')
+parser.add_argument('--checkpoint_path', type=str, required=True, help='fp32 Wav2Lip checkpoint')
+parser.add_argument('--int8_checkpoint', type=str, required=True, help='int8 archive from Wav2Lip.quantize')
+parser.add_argument('--face', type=str, required=True, help='Avatar image')
+parser.add_argument('--audio', type=str, nargs='+', required=True, help='Evaluation utterances (.wav)')
+parser.add_argument('--syncnet_checkpoint', type=str, default=None, help='Optional SyncNet expert checkpoint')
+parser.add_argument('--batch_size', type=int, default=32, help='Mel chunks per forward pass')
+parser.add_argument('--repeats', type=int, default=3, help='Timed runs per model; the fastest is reported')
+
+
+def run(model, face, mels, repeats):
+    with torch.no_grad():
+        feats = model.encode_face(face)
+        best, preds = float('inf'), None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            preds = [model.decode(mel, feats) for mel in mels]
+            best = min(best, time.perf_counter() - start)
+    return best, torch.cat(preds)
+
+
+def load_syncnet(path):
+    syncnet = SyncNet_color()
+    state_dict = torch.load(path, map_location='cpu')["state_dict"]
+    syncnet.load_state_dict({k.replace("module.", ""): v for k, v in state_dict.items()})
+    return syncnet.eval()
+
+
+def sync_confidence(syncnet, mels, frames, syncnet_T=5):
+    """Mean cosine similarity between SyncNet audio and lower-half video embeddings."""
+    lower = frames[:, :, frames.size(2) // 2:]
+    count = len(frames) - syncnet_T + 1
+    windows = torch.cat([lower[i:i + count] for i in range(syncnet_T)], dim=1)
+    with torch.no_grad():
+        audio_embedding, face_embedding = syncnet(mels[:count], windows)
+    return F.cosine_similarity(audio_embedding, face_embedding).mean().item()
+
+
+def main(args):
+    fp32 = load_checkpoint(args.checkpoint_path, 'cpu')
+    int8 = load_checkpoint(args.int8_checkpoint, 'cpu')
+    face = face_input(args.face)
+    mels = list(mel_batches(args.audio, args.batch_size))
+    num_chunks = sum(len(m) for m in mels)
+
+    fp32_time, fp32_frames = run(fp32, face, mels, args.repeats)
+    int8_time, int8_frames = run(int8, face, mels, args.repeats)
+
+    diff = (fp32_frames - int8_frames).abs() * 255.
+    mse = ((fp32_frames - int8_frames) ** 2).mean().item()
+    psnr = 10 * np.log10(1.0 / mse) if mse > 0 else float('inf')
+
+    print('Chunks: {} ({} threads, batch size {})'.format(num_chunks, torch.get_num_threads(), args.batch_size))
+    print('fp32: {:.3f}s ({:.1f} frames/s)'.format(fp32_time, num_chunks / fp32_time))
+    print('int8: {:.3f}s ({:.1f} frames/s)'.format(int8_time, num_chunks / int8_time))
+    print('Speedup: {:.2f}x'.format(fp32_time / int8_time))
+    print('Pixel delta (0-255): mean {:.3f}, max {:.1f}, PSNR {:.2f} dB'.format(diff.mean().item(), diff.max().item(), psnr))
+
+    if args.syncnet_checkpoint:
+        syncnet = load_syncnet(args.syncnet_checkpoint)
+        all_mels = torch.cat(mels)
+        fp32_sync = sync_confidence(syncnet, all_mels, fp32_frames)
+        int8_sync = sync_confidence(syncnet, all_mels, int8_frames)
+        print('SyncNet confidence: fp32 {:.4f}, int8 {:.4f}, delta {:+.4f}'.format(fp32_sync, int8_sync, int8_sync - fp32_sync))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,57 @@
+"""Compare the librosa mel path with the batched torch engine.
+
+Times `Wav2Lip.audio.melspectrogram` called once per waveform against one
+`Wav2Lip.mel_torch.MelSpectrogram` call for the whole batch, and reports the
+largest difference between the two outputs (normalized mel units).
+
+    python -m benchmarks.mel --audio sample1.wav sample2.wav --batch_size 1 8 32
+"""
+import argparse
+import time
+import numpy as np
+import torch
+
+from Wav2Lip import audio
+from Wav2Lip.mel_torch import MelSpectrogram
+
+parser = argparse.ArgumentParser(description='Benchmark the torch mel engine against librosa')
+parser.add_argument('--audio', type=str, nargs='*', default=[], help='Utterances (.wav); random speech-length noise when omitted')
+parser.add_argument('--seconds', type=float, default=4., help='Length of the random waveforms')
+parser.add_argument('--batch_size', type=int, nargs='+', default=[1, 8, 32], help='Waveforms per call')
+parser.add_argument('--threads', type=int, default=torch.get_num_threads(), help='Torch intra-op threads')
+parser.add_argument('--repeats', type=int, default=5, help='Timed runs per configuration; the median is reported')
+
+
+def median_time(fn, repeats):
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    rng = np.random.default_rng(0)
+    if args.audio:
+        pool = [audio.load_wav(path, 16000) for path in args.audio]
+    else:
+        pool = [(0.1 * rng.standard_normal(int(args.seconds * 16000))).astype(np.float32)]
+    engine = MelSpectrogram('cpu')
+
+    print('{:>6} {:>12} {:>12} {:>8} {:>10}'.format('batch', 'librosa ms', 'torch ms', 'speedup', 'max diff'))
+    for batch_size in args.batch_size:
+        wavs = [pool[i % len(pool)] for i in range(batch_size)]
+        expected = [audio.melspectrogram(wav) for wav in wavs]
+        error = max(np.abs(e - a).max() for e, a in zip(expected, engine(wavs)))
+
+        base = median_time(lambda: [audio.melspectrogram(wav) for wav in wavs], args.repeats)
+        fast = median_time(lambda: engine(wavs), args.repeats)
+        print('{:>6} {:>12.2f} {:>12.2f} {:>7.2f}x {:>10.2e}'.format(
+            batch_size, 1000 * base, 1000 * fast, base / fast, error))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
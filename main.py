@@ -1,6 +1,10 @@
 # main.py
 from fastapi import FastAPI
-from router import attendee, avatar, session, socket_server, prediction
+from fastapi.responses import PlainTextResponse
+from router import attendee, avatar, session, socket_server, prediction, lipsync_jobs, artifacts
+from router.utterance_cache import cache as utterance_cache
+from router import metrics
+from router.lip_sync_pool import shutdown_pool
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
@@ -33,6 +37,38 @@ app.include_router(
     prefix="/prediction", 
     tags=["Prediction"])
 
+app.include_router(
+    lipsync_jobs.router, 
+    prefix="/lipsync/jobs", 
+    tags=["Lip Sync"])
+
+app.include_router(
+    artifacts.router, 
+    prefix="/artifacts", 
+    tags=["Artifacts"])
+
+# Load the Wav2Lip checkpoint once so transcriptions hit a warm model
+@app.on_event("startup")
+async def warm_up_models():
+    metrics.start_event_loop_monitor()
+    socket_server.warm_up_lip_sync()
+
+@app.on_event("shutdown")
+async def stop_lip_sync_workers():
+    metrics.stop_event_loop_monitor()
+    lipsync_jobs.jobs.shutdown()
+    shutdown_pool()
+
+# Hit rate and size of the TTS/lip-sync utterance cache
+@app.get("/lipsync/cache/stats", tags=["Lip Sync"])
+async def utterance_cache_stats():
+    return utterance_cache.stats()
+
+# Stage latencies, queue depths and cache sizes in the Prometheus text format
+@app.get("/metrics", tags=["Lip Sync"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Mount the combined ASGI app (FastAPI + Socket.IO)
 app.mount('/socket.io', socket_server.socket_app)
 
@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class LipSyncJobRequest(BaseModel):
+    text: str
+    language: str = "en-US"
+    # Voice and face default to the avatar's when avatar_id is given
+    avatar_id: Optional[int] = None
+    voice_code: Optional[str] = None
+    # Higher runs first; jobs with equal priority run in submission order
+    priority: int = 0
+
+class LipSyncJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued, running, completed, failed or cancelled
+    priority: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = None
+    error: Optional[str] = None
+    result_url: Optional[str] = None
@@ -0,0 +1,160 @@
+"""Content-addressed store for rendered videos served over HTTP.
+
+Each artifact is named after the sha256 of its bytes, so concurrent renders
+never overwrite each other and identical outputs are stored once. The store
+is bounded by size (least recently used artifacts go first) and by age:
+artifacts not written or served for ARTIFACT_TTL_SECONDS are deleted.
+Files are served by router/artifacts.py at /artifacts/{name}.
+
+Configuration (environment variables):
+    ARTIFACT_DIR          directory of the store (default static/output/artifacts)
+    ARTIFACT_MAX_MB       size budget (default 2048)
+    ARTIFACT_TTL_SECONDS  lifetime since last use (default 86400)
+    ARTIFACT_BASE_URL     prefix for artifact URLs, e.g. https://cdn.example.com (default: relative)
+"""
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from router import metrics
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "static/output/artifacts")
+ARTIFACT_MAX_MB = float(os.getenv("ARTIFACT_MAX_MB", "2048"))
+ARTIFACT_TTL_SECONDS = float(os.getenv("ARTIFACT_TTL_SECONDS", "86400"))
+ARTIFACT_BASE_URL = os.getenv("ARTIFACT_BASE_URL", "").rstrip("/")
+
+# Media types of the suffixes the store accepts
+MEDIA_TYPES = {".mp4": "video/mp4", ".wav": "audio/wav"}
+_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)$")
+# Files being written keep their real suffix last, so ffmpeg and OpenCV pick the right container;
+# the pattern also matches the older {uuid}.mp4.tmp names
+_TEMP = re.compile(r"^[0-9a-f]{32}(\.[a-z0-9]+)?\.tmp(\.[a-z0-9]+)?$")
+
+
+class ArtifactStore:
+    """Size- and TTL-bounded LRU directory of files named by content hash."""
+
+    def __init__(self, directory=ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_MB * 1024 ** 2, ttl=ARTIFACT_TTL_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # name -> (size, last use), least recently used first
+        self._size = 0
+        self._counts = {"writes": 0, "dedups": 0, "evictions": 0, "expirations": 0}
+        self._scan()
+
+    def _scan(self):
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if _NAME.match(name):
+                entries.append((os.path.getmtime(path), name, os.path.getsize(path)))
+            elif _TEMP.match(name):
+                os.remove(path)  # left behind by an interrupted write or render
+        for used, name, size in sorted(entries):
+            self._entries[name] = (size, used)
+            self._size += size
+
+    def temp_path(self, suffix=".mp4"):
+        """A unique path inside the store for a file that is about to be added with `put_file`."""
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}.tmp{suffix}")
+
+    def put(self, data, suffix=".mp4"):
+        """Store `data` and return its name; storing the same bytes again only refreshes it."""
+        name = hashlib.sha256(data).hexdigest() + suffix
+        with self._lock:
+            if self._touch(name):
+                self._counts["dedups"] += 1
+                return name
+            tmp_path = self.temp_path(suffix)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            self._add(name, tmp_path)
+        return name
+
+    def put_file(self, path, suffix=".mp4"):
+        """Move a finished file (e.g. one rendered to `temp_path`) into the store; returns its name."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        name = digest.hexdigest() + suffix
+        with self._lock:
+            if self._touch(name):
+                self._counts["dedups"] += 1
+                os.remove(path)
+                return name
+            self._add(name, path)
+        return name
+
+    def path(self, name):
+        """Filesystem path of a live artifact, marking it as used, or None."""
+        if not _NAME.match(name):
+            return None
+        with self._lock:
+            self._expire()
+            if not self._touch(name):
+                return None
+            return os.path.join(self.directory, name)
+
+    def url(self, name):
+        return f"{ARTIFACT_BASE_URL}/artifacts/{name}"
+
+    def _touch(self, name):
+        entry = self._entries.get(name)
+        path = os.path.join(self.directory, name)
+        if entry is None or not os.path.exists(path):
+            return False
+        now = time.time()
+        os.utime(path, (now, now))  # keeps the LRU order across restarts
+        self._entries[name] = (entry[0], now)
+        self._entries.move_to_end(name)
+        return True
+
+    def _add(self, name, source):
+        os.replace(source, os.path.join(self.directory, name))
+        size = os.path.getsize(os.path.join(self.directory, name))
+        self._size -= self._entries.pop(name, (0, 0))[0]
+        self._entries[name] = (size, time.time())
+        self._size += size
+        self._counts["writes"] += 1
+        self._expire()
+        # Keep the newest artifact even if it alone exceeds the budget
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+            self._counts["evictions"] += 1
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        while self._entries:
+            name, (_, used) = next(iter(self._entries.items()))
+            if used >= cutoff:
+                break
+            self._remove(name)
+            self._counts["expirations"] += 1
+
+    def _remove(self, name):
+        size, _ = self._entries.pop(name)
+        self._size -= size
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """Number and total size of stored artifacts plus write/dedup/eviction counters."""
+        with self._lock:
+            return dict(self._counts, artifacts=len(self._entries), bytes=self._size)
+
+
+store = ArtifactStore()
+
+metrics.Callback("lipsync_artifacts", "Files in the artifact store.", lambda: store.stats()["artifacts"])
+metrics.Callback("lipsync_artifact_bytes", "Size of the artifact store.", lambda: store.stats()["bytes"])
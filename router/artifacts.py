@@ -0,0 +1,17 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from router.artifact_store import store, MEDIA_TYPES, ARTIFACT_TTL_SECONDS
+import os
+
+router = APIRouter()
+
+@router.api_route("/{name}", methods=["GET", "HEAD"])
+async def get_artifact(name: str):
+    """Serve a stored artifact; FileResponse answers Range requests with 206 partial content."""
+    path = store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Artifact {name} not found or expired")
+    media_type = MEDIA_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+    # Names are content hashes, so a name always refers to the same bytes
+    headers = {"Cache-Control": f"public, max-age={int(ARTIFACT_TTL_SECONDS)}, immutable"}
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -0,0 +1,220 @@
+"""Precomputed avatar bundles.
+
+A bundle holds everything `generate_lip_sync` derives from a still avatar:
+the decoded frame, the face box, the 96x96 masked/unmasked Wav2Lip input and
+the encoder feature pyramid. Bundles are built offline per
+`tbl_aiterp_Avatars` row and memory-mapped by the server at startup.
+
+Build them with:
+
+    python -m router.avatar_bundle --checkpoint_path Wav2Lip/checkpoints/wav2lip_gan.pth
+"""
+import os
+import json
+import struct
+import argparse
+import urllib.request
+import numpy as np
+import cv2
+import torch
+
+from router.lip_sync import load_model, prepare_face_batch, to_channels_last, detect_face_box, device
+
+BUNDLE_DIR = "static/bundles"
+BUNDLE_EXT = ".avb"
+FACES_DIR = "static/faces"
+
+_MAGIC = b"AVBUNDLE"
+_VERSION = 1
+_ALIGN = 64
+
+# Bundles loaded at startup, keyed by avatar_id
+_bundles = {}
+
+
+def checkpoint_id(checkpoint_path):
+    """Identify a checkpoint cheaply so stale encoder features can be detected."""
+    return f"{os.path.basename(checkpoint_path)}:{os.path.getsize(checkpoint_path)}"
+
+
+def write_bundle(path, arrays, meta):
+    """Write `arrays` (name -> ndarray) and `meta` into a single aligned bundle file."""
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    header = json.dumps({"version": _VERSION, "meta": meta, "arrays": layout}).encode("utf-8")
+    data_start = -(-(len(_MAGIC) + 4 + len(header)) // _ALIGN) * _ALIGN
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_bundle(path):
+    """Memory-map a bundle file and return (meta, name -> ndarray)."""
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} is not an avatar bundle.")
+        header_len = struct.unpack("<I", f.read(4))[0]
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    if header["version"] != _VERSION:
+        raise ValueError(f"Unsupported avatar bundle version {header['version']} in {path}.")
+
+    data_start = -(-(len(_MAGIC) + 4 + header_len) // _ALIGN) * _ALIGN
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        # Copy-on-write keeps the file untouched while giving torch a writable view
+        arrays[name] = np.memmap(path, dtype=np.dtype(spec["dtype"]), mode="c",
+                                 offset=data_start + spec["offset"], shape=tuple(spec["shape"]))
+    return header["meta"], arrays
+
+
+class AvatarBundle:
+    """In-memory view of a bundle: frame, face box, model input and encoder features."""
+
+    def __init__(self, meta, frame, box, face_input, feats):
+        self.meta = meta
+        self.avatar_id = meta.get("avatar_id")
+        self.frame = frame
+        self.box = box
+        self.face_input = face_input
+        self.feats = feats
+
+    @classmethod
+    def load(cls, path, checkpoint_path=None):
+        """Memory-map `path`; features are re-encoded if they came from another checkpoint."""
+        meta, arrays = read_bundle(path)
+        face_input = torch.from_numpy(arrays["face_input"]).to(device)
+        num_feats = meta["num_feats"]
+
+        if checkpoint_path is not None and meta.get("checkpoint") != checkpoint_id(checkpoint_path):
+            print(f"Bundle {path} was built with another checkpoint; re-encoding face features.")
+            with torch.no_grad():
+                feats = load_model(checkpoint_path).encode_face(face_input)
+        else:
+            feats = [torch.from_numpy(arrays[f"feat_{i}"]).to(device) for i in range(num_feats)]
+        feats = to_channels_last(feats)
+
+        return cls(meta, arrays["frame"], tuple(int(v) for v in arrays["box"]), face_input, feats)
+
+
+def load_avatar_image(avatar_img):
+    """Decode an avatar image given as a URL, a path or a file name under static/faces."""
+    if avatar_img.startswith(("http://", "https://")):
+        with urllib.request.urlopen(avatar_img, timeout=30) as response:
+            data = np.frombuffer(response.read(), dtype=np.uint8)
+        frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    else:
+        path = avatar_img if os.path.exists(avatar_img) else os.path.join(FACES_DIR, avatar_img)
+        frame = cv2.imread(path)
+    if frame is None:
+        raise FileNotFoundError(f"Avatar image {avatar_img} could not be loaded.")
+    return frame
+
+
+def build_bundle(avatar_id, avatar_img, checkpoint_path, bundle_dir=BUNDLE_DIR, img_size=96):
+    """Preprocess one avatar and write its bundle file. Returns the bundle path."""
+    frame = load_avatar_image(avatar_img)
+    box = np.array(detect_face_box(frame), dtype=np.int32)  # x1, y1, x2, y2, padded
+
+    x1, y1, x2, y2 = box
+    face = cv2.resize(frame[y1:y2, x1:x2], (img_size, img_size))
+    face_input = prepare_face_batch([face], img_size)
+    with torch.no_grad():
+        feats = load_model(checkpoint_path).encode_face(face_input)
+
+    arrays = {"frame": frame, "box": box, "face_input": face_input.cpu().numpy()}
+    for i, feat in enumerate(feats):
+        arrays[f"feat_{i}"] = feat.cpu().numpy()
+
+    meta = {
+        "avatar_id": avatar_id,
+        "avatar_img": avatar_img,
+        "img_size": img_size,
+        "num_feats": len(feats),
+        "checkpoint": checkpoint_id(checkpoint_path),
+    }
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    path = os.path.join(bundle_dir, f"{avatar_id}{BUNDLE_EXT}")
+    write_bundle(path, arrays, meta)
+    print(f"Avatar bundle for avatar {avatar_id} written to {path}")
+    return path
+
+
+def load_bundles(checkpoint_path, bundle_dir=BUNDLE_DIR):
+    """Memory-map every bundle in `bundle_dir`, replacing the currently loaded set."""
+    bundles = {}
+    if os.path.isdir(bundle_dir):
+        for name in sorted(os.listdir(bundle_dir)):
+            if not name.endswith(BUNDLE_EXT):
+                continue
+            try:
+                bundle = AvatarBundle.load(os.path.join(bundle_dir, name), checkpoint_path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping avatar bundle {name}: {e}")
+                continue
+            bundles[bundle.avatar_id] = bundle
+
+    _bundles.clear()
+    _bundles.update(bundles)
+    print(f"Loaded {len(bundles)} avatar bundle(s) from {bundle_dir}.")
+    return bundles
+
+
+def get_bundle(avatar_id):
+    """Return the loaded bundle for `avatar_id`, or None."""
+    return _bundles.get(avatar_id)
+
+
+def fetch_avatars(avatar_id=None):
+    """Read (avatar_id, avatar_img) rows from tbl_aiterp_Avatars."""
+    from db import get_db_connection
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if avatar_id is None:
+            cursor.execute("SELECT avatar_id, avatar_img FROM tbl_aiterp_Avatars")
+        else:
+            cursor.execute("SELECT avatar_id, avatar_img FROM tbl_aiterp_Avatars WHERE avatar_id = ?", avatar_id)
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build precomputed avatar bundles for the lip-sync server')
+    parser.add_argument('--checkpoint_path', type=str, required=True,
+                        help='Wav2Lip checkpoint used to encode the face features')
+    parser.add_argument('--avatar_id', type=int, default=None,
+                        help='Only build the bundle for this avatar (default: every avatar)')
+    parser.add_argument('--image', type=str, default=None,
+                        help='Use this image instead of reading avatar_img from the database (requires --avatar_id)')
+    parser.add_argument('--bundle_dir', type=str, default=BUNDLE_DIR,
+                        help='Directory the bundles are written to')
+    args = parser.parse_args()
+
+    if args.image:
+        if args.avatar_id is None:
+            parser.error('--image requires --avatar_id')
+        avatars = [(args.avatar_id, args.image)]
+    else:
+        avatars = fetch_avatars(args.avatar_id)
+
+    for avatar_id, avatar_img in avatars:
+        try:
+            build_bundle(avatar_id, avatar_img, args.checkpoint_path, args.bundle_dir)
+        except (OSError, ValueError) as e:
+            print(f"Failed to build bundle for avatar {avatar_id}: {e}")
+
+
+if __name__ == '__main__':
+    main()
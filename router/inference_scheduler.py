@@ -0,0 +1,134 @@
+"""Cross-room dynamic batching for Wav2Lip decoder passes.
+
+Jobs running in the lip-sync pool submit their mel chunks together with the
+avatar's encoder features. A single scheduler thread collects pending
+requests from every job until it has `max_batch_size` chunks or the oldest
+request has waited `max_wait_ms`, runs one `decode` over the merged batch
+and hands each job back its slice of frames.
+
+Enable with LIPSYNC_SCHEDULER=1 (thread executor only; every process would
+otherwise run its own scheduler). LIPSYNC_SCHEDULER_BATCH and
+LIPSYNC_SCHEDULER_WAIT_MS tune the batch limit and latency deadline.
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import torch
+
+from router.lip_sync import load_model
+from router import metrics
+
+LIPSYNC_SCHEDULER = os.getenv("LIPSYNC_SCHEDULER", "0") == "1"
+LIPSYNC_SCHEDULER_BATCH = int(os.getenv("LIPSYNC_SCHEDULER_BATCH", "64"))
+LIPSYNC_SCHEDULER_WAIT_MS = float(os.getenv("LIPSYNC_SCHEDULER_WAIT_MS", "10"))
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+metrics.Callback("lipsync_scheduler_pending_requests", "Decoder requests waiting for the scheduler.",
+                 lambda: {path: s.pending() for path, s in list(_schedulers.items())}, ["checkpoint"])
+metrics.Callback("lipsync_scheduler_batches_total", "Merged forward passes run by the scheduler.",
+                 lambda: {path: s.stats()["batches"] for path, s in list(_schedulers.items())}, ["checkpoint"],
+                 kind="counter")
+
+
+class _Request:
+    __slots__ = ("mels", "feats", "future")
+
+    def __init__(self, mels, feats):
+        self.mels = mels
+        self.feats = feats
+        self.future = Future()
+
+
+class InferenceScheduler:
+    """Merges decoder requests from concurrent jobs into shared forward passes."""
+
+    def __init__(self, model, max_batch_size=LIPSYNC_SCHEDULER_BATCH, max_wait_ms=LIPSYNC_SCHEDULER_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._held = None  # a request that did not fit into the previous batch
+        self._batches = 0
+        self._chunks = 0
+        self._thread = threading.Thread(target=self._run, name="wav2lip-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, mel_batch, feats):
+        """Queue a (B, 1, 80, 16) mel tensor; the future resolves to the (B, 3, 96, 96) prediction."""
+        request = _Request(mel_batch, feats)
+        self._queue.put(request)
+        return request.future
+
+    def pending(self):
+        return self._queue.qsize() + (self._held is not None)
+
+    def stats(self):
+        return {
+            "batches": self._batches,
+            "chunks": self._chunks,
+            "mean_batch_size": self._chunks / self._batches if self._batches else 0.0,
+            "pending": self.pending(),
+        }
+
+    def _collect(self):
+        """Gather requests up to `max_batch_size` chunks; one that would overflow waits for the next batch."""
+        if self._held is not None:
+            requests, self._held = [self._held], None
+        else:
+            requests = [self._queue.get()]
+        size = len(requests[0].mels)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request.mels) > self.max_batch_size:
+                self._held = request
+                break
+            requests.append(request)
+            size += len(request.mels)
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            try:
+                mels = torch.cat([r.mels for r in requests])
+                if all(r.feats is requests[0].feats for r in requests):
+                    # One avatar: let decode broadcast the single face
+                    feats = requests[0].feats
+                else:
+                    feats = [torch.cat([r.feats[i].expand(len(r.mels), -1, -1, -1) for r in requests])
+                             for i in range(len(requests[0].feats))]
+
+                with torch.no_grad():
+                    pred = self.model.decode(mels, feats)
+            except Exception as e:
+                for r in requests:
+                    r.future.set_exception(e)
+                continue
+
+            self._batches += 1
+            self._chunks += len(mels)
+            start = 0
+            for r in requests:
+                r.future.set_result(pred[start:start + len(r.mels)])
+                start += len(r.mels)
+
+
+def get_scheduler(checkpoint_path):
+    """Return the process-wide scheduler for a checkpoint, creating it on first use."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(checkpoint_path)
+        if scheduler is None:
+            scheduler = InferenceScheduler(load_model(checkpoint_path))
+            _schedulers[checkpoint_path] = scheduler
+        return scheduler
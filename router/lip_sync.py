@@ -1,23 +1,66 @@
 import os
+import time
+import itertools
+import collections
+import threading
 import torch
 import numpy as np
 import cv2
 from tqdm import tqdm
-from Wav2Lip.models.wav2lip import Wav2Lip
-from Wav2Lip.audio import load_wav, melspectrogram
+from Wav2Lip.model_registry import registry as model_registry
+from Wav2Lip.batching import FaceBatchBuffer, mel_tensor
+from Wav2Lip.audio import load_audio, melspectrogram, split_mel
+from Wav2Lip.mel_torch import melspectrogram_batch
+from Wav2Lip.hparams import hparams as hp
+from Wav2Lip.encoder import open_encoder, ffmpeg_binary, FFmpegEncoder
+from router.pipeline import Pipeline
+from router import metrics
 import argparse
 
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
+# Same default as --wav2lip_batch_size in Wav2Lip/inference.py
+MAX_BATCH_SIZE = 128
+# Peak activation memory of one decoder sample (fp32, measured on CPU)
+BYTES_PER_SAMPLE = 10 * 1024 ** 2
+# Share of the currently free memory a single utterance may claim
+MEMORY_FRACTION = 0.25
+# Fold BatchNorm into the convolutions when loading (see Wav2Lip/models/fused.py)
+WAV2LIP_FUSED = os.getenv("WAV2LIP_FUSED", "0") == "1"
+# Keep weights, inputs and cached features in NHWC (channels-last) layout for oneDNN
+WAV2LIP_CHANNELS_LAST = os.getenv("WAV2LIP_CHANNELS_LAST", "0") == "1"
+# "torch" computes mel spectrograms in float32 with Wav2Lip/mel_torch.py instead of librosa
+WAV2LIP_MEL_ENGINE = os.getenv("WAV2LIP_MEL_ENGINE", "librosa")
+# Length of each video segment yielded by generate_lip_sync_stream
+SEGMENT_SECONDS = float(os.getenv("LIPSYNC_SEGMENT_SECONDS", "1.0"))
+# x264 speed/quality trade-off for the ffmpeg encoder: "fast", "balanced" or "quality"
+ENCODER_PRESET = os.getenv("LIPSYNC_ENCODER_PRESET", "balanced")
+# Reuse an idle (closed-mouth) face for silent stretches instead of running the model
+SKIP_SILENCE = os.getenv("LIPSYNC_SKIP_SILENCE", "1") == "1"
+# Loudest mel column (mean over bins, normalized to [-4, 4]) below which a chunk is silent
+SILENCE_LEVEL = float(os.getenv("LIPSYNC_SILENCE_LEVEL", "-3.0"))
+# Shortest silent run that is skipped, in frames; shorter pauses are animated normally
+SILENCE_MIN_FRAMES = int(os.getenv("LIPSYNC_SILENCE_MIN_FRAMES", "3"))
+# Frames on each side of a silent run that blend the idle face with the neighbouring speech frame
+CROSSFADE_FRAMES = int(os.getenv("LIPSYNC_CROSSFADE_FRAMES", "2"))
+# Padding around the detected face (top, bottom, left, right), as --pads in Wav2Lip/inference.py
+FACE_PADS = (0, 10, 0, 0)
+# Overlap mel batching, the forward passes and resize/encode on separate threads (router/pipeline.py)
+PIPELINE = os.getenv("LIPSYNC_PIPELINE", "1") == "1"
+# Batches buffered between two pipeline stages
+PIPELINE_DEPTH = int(os.getenv("LIPSYNC_PIPELINE_DEPTH", "2"))
+# Batches one job keeps queued in the InferenceScheduler (the next one is submitted while one runs)
+SCHEDULER_IN_FLIGHT = 2
+
 def load_model(checkpoint_path):
-    print("Loading Wav2Lip model...")
-    model = Wav2Lip()
-    checkpoint = torch.load(checkpoint_path, map_location=device)
-    state_dict = checkpoint["state_dict"]
-    model.load_state_dict({k.replace("module.", ""): v for k, v in state_dict.items()})
-    model = model.to(device).eval()
-    print("Model loaded.")
-    return model
+    """Return the resident Wav2Lip model, loading it only on first use."""
+    return model_registry.get(checkpoint_path, device, fused=WAV2LIP_FUSED, channels_last=WAV2LIP_CHANNELS_LAST)
+
+def to_channels_last(feats):
+    """Convert cached encoder features to the layout the model runs in."""
+    if not WAV2LIP_CHANNELS_LAST:
+        return feats
+    return [f.contiguous(memory_format=torch.channels_last) for f in feats]
 
 def preprocess_image(image_path, resize_factor=1, crop=None):
     """Load a single image and preprocess it."""
@@ -33,166 +76,446 @@ def preprocess_image(image_path, resize_factor=1, crop=None):
     print("Image loaded and preprocessed.")
     return [frame]  # Return as a list to mimic video frames
 
-def preprocess_audio(audio_path, fps, mel_step_size=16):
-    """Load and process the audio file into mel chunks."""
-    print(f"Processing audio from {audio_path}...")
-    wav = load_wav(audio_path, 16000)
-    mel = melspectrogram(wav)
-    mel_chunks = []
-    mel_idx_multiplier = 80.0 / fps
-
-    i = 0
-    while True:
-        start_idx = int(i * mel_idx_multiplier)
-        if start_idx + mel_step_size > mel.shape[1]:
-            # Handle the last chunk with padding
-            chunk = mel[:, start_idx:]
-            chunk = np.pad(chunk, ((0, 0), (0, mel_step_size - chunk.shape[1])), mode="constant")
-            mel_chunks.append(chunk)
-            break
-        mel_chunks.append(mel[:, start_idx:start_idx + mel_step_size])
-        i += 1
-
+def preprocess_audio(audio, fps, mel_step_size=16):
+    """Turn a wav path, in-memory WAV bytes or a 16 kHz sample array into mel chunks."""
+    print(f"Processing audio from {audio if isinstance(audio, str) else type(audio).__name__}...")
+    if isinstance(audio, np.ndarray):
+        wav = load_audio(audio, 16000)
+    else:
+        with metrics.stage("audio_decode"):
+            wav = load_audio(audio, 16000)
+    with metrics.stage("mel"):
+        if WAV2LIP_MEL_ENGINE == "torch":
+            mel = melspectrogram_batch([wav])[0]
+        else:
+            mel = melspectrogram(wav)
+        # The last chunk is zero-padded to mel_step_size
+        mel_chunks = split_mel(mel, fps, mel_step_size)
     print(f"Generated {len(mel_chunks)} mel chunks.")
-    return np.array(mel_chunks)
-
-def datagen(frames, mels, img_size):
-    """Generator to batch frames and mel spectrograms."""
-    img_batch, mel_batch = [], []
-    for i, mel in enumerate(mels):
-        frame = cv2.resize(frames[0], (img_size, img_size))  # Use the single frame repeatedly
-        img_batch.append(frame)
-        mel_batch.append(mel)
-
-        if len(img_batch) >= 1:  # Process one frame per mel chunk
-            yield prepare_batch(img_batch, mel_batch, img_size)
-            img_batch, mel_batch = [], []
-
-    if len(img_batch) > 0:
-        yield prepare_batch(img_batch, mel_batch, img_size)
+    return mel_chunks
+
+def available_memory():
+    """Free memory on the inference device in bytes, or None if it cannot be determined."""
+    if device == 'cuda':
+        return torch.cuda.mem_get_info()[0]
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def auto_batch_size(num_chunks):
+    """Pick a batch size from the utterance length and the memory currently free."""
+    batch_size = min(MAX_BATCH_SIZE, max(1, num_chunks))
+    free = available_memory()
+    if free is not None:
+        batch_size = min(batch_size, max(1, int(free * MEMORY_FRACTION) // BYTES_PER_SAMPLE))
+    return batch_size
+
+def datagen(mels, batch_size, lead=0):
+    """Generator to batch mel spectrogram chunks.
+
+    `mels` is sliced rather than copied, so a contiguous float32 chunk array
+    reaches the model without any intermediate arrays on CPU. The first
+    batch holds `lead` extra chunks, shifting every later batch boundary.
+    """
+    first = min(len(mels), batch_size + lead)
+    if first:
+        yield prepare_mel_batch(mels[:first])
+    for start in range(first, len(mels), batch_size):
+        yield prepare_mel_batch(mels[start:start + batch_size])
+
+def prepare_face_batch(img_batch, img_size):
+    """Build the 6-channel (masked + reference) face input for Wav2Lip."""
+    buffer = FaceBatchBuffer(len(img_batch), img_size, device, channels_last=WAV2LIP_CHANNELS_LAST)
+    for i, face in enumerate(img_batch):
+        buffer.fill(i, face)
+    return buffer.to_tensor(len(img_batch))
+
+def prepare_mel_batch(mel_batch):
+    """Convert mel chunks to a (B, 1, 80, 16) tensor (valid NCHW and NHWC, as C is 1)."""
+    return mel_tensor(mel_batch, device)
 
 def prepare_batch(img_batch, mel_batch, img_size):
     """Prepare image and mel batches."""
-    img_batch = np.asarray(img_batch)
-    mel_batch = np.asarray(mel_batch)
-
-    # Mask lower half of the face for Wav2Lip input
-    img_masked = img_batch.copy()
-    img_masked[:, img_size // 2:] = 0
-    img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.0
-
-    mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
-
-    return torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(device), \
-           torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(device)
+    return prepare_face_batch(img_batch, img_size), prepare_mel_batch(mel_batch)
+
+_face_detector = None
+
+def detect_face_box(frame, pads=FACE_PADS):
+    """Padded (x1, y1, x2, y2) box of the face in a BGR frame, found with the SFD detector.
+
+    Falls back to the whole frame when no face is found or the detector
+    weights cannot be loaded, which matches the previous full-frame behaviour.
+    """
+    global _face_detector
+    frame_h, frame_w = frame.shape[:2]
+    try:
+        if _face_detector is None:
+            # Imported directly: FaceAlignment resolves the detector with a top-level __import__
+            from Wav2Lip.face_detection.detection.sfd import FaceDetector
+            _face_detector = FaceDetector(device=device)
+        detections = _face_detector.detect_from_batch(np.ascontiguousarray(frame[None, ..., ::-1]))[0]
+    except Exception as e:
+        print(f"Face detection unavailable ({e}); using the whole frame.")
+        return (0, 0, frame_w, frame_h)
+    if len(detections) == 0:
+        print("No face detected; using the whole frame.")
+        return (0, 0, frame_w, frame_h)
+
+    x1, y1, x2, y2 = (int(v) for v in np.clip(detections[0][:-1], 0, None))
+    pady1, pady2, padx1, padx2 = pads
+    return (max(0, x1 - padx1), max(0, y1 - pady1), min(frame_w, x2 + padx2), min(frame_h, y2 + pady2))
+
+# Face boxes and encoder feature pyramids for still avatars, keyed by image file and preprocessing
+_face_box_cache = {}
+_face_feature_cache = {}
+
+def _image_key(image_path, resize_factor, crop):
+    return (os.path.abspath(image_path), os.path.getmtime(image_path), resize_factor, tuple(crop) if crop else None)
+
+def get_face_box(image_path, frame, resize_factor=1, crop=None):
+    """Detect the avatar face once and reuse the box for every utterance."""
+    key = _image_key(image_path, resize_factor, crop)
+    box = _face_box_cache.get(key)
+    if box is None:
+        box = _face_box_cache[key] = detect_face_box(frame)
+    return box
+
+def get_face_features(model, image_path, frame, img_size, resize_factor=1, crop=None):
+    """Encode the avatar face crop once and reuse the features for every utterance."""
+    key = _image_key(image_path, resize_factor, crop) + (id(model),)
+    feats = _face_feature_cache.get(key)
+    if feats is None:
+        x1, y1, x2, y2 = get_face_box(image_path, frame, resize_factor, crop)
+        face = cv2.resize(frame[y1:y2, x1:x2], (img_size, img_size))
+        with torch.no_grad():
+            feats = model.encode_face(prepare_face_batch([face], img_size))
+        _face_feature_cache[key] = feats
+    return feats
+
+def silent_chunks(mel_chunks, level=SILENCE_LEVEL, min_frames=SILENCE_MIN_FRAMES):
+    """Boolean mask of mel chunks inside silent runs of at least `min_frames` chunks.
+
+    A chunk is silent when every column of its window is quiet, so frames
+    whose window reaches into speech are still animated.
+    """
+    loudness = mel_chunks.mean(axis=1).max(axis=1)
+    silent = loudness < level
+    # Clear runs that are too short to be worth skipping
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.astype(np.int8), [0]))))
+    for start, end in zip(edges[::2], edges[1::2]):
+        if end - start < min_frames:
+            silent[start:end] = False
+    return silent
+
+# Frames rendered and forward passes skipped on silence since startup
+skipped_counts = {"frames": 0, "skipped": 0}
+metrics.Callback("lipsync_frames_total", "Video frames rendered.",
+                 lambda: skipped_counts["frames"], kind="counter")
+metrics.Callback("lipsync_frames_skipped_total", "Frames whose forward pass was skipped on silence.",
+                 lambda: skipped_counts["skipped"], kind="counter")
+metrics.Callback("lipsync_model_load_seconds", "Load time of each resident Wav2Lip model.",
+                 lambda: {(s["checkpoint_path"], s["precision"]): s["load_time"] for s in model_registry.stats()},
+                 ["checkpoint", "precision"])
+
+# Idle face prediction per (model, encoder features), keyed by id() and holding both alive
+_idle_faces = {}
+
+def get_idle_face(model, feats):
+    """Wav2Lip output for a silent mel window: the avatar's closed-mouth face (HxWx3, 0-255)."""
+    key = (id(model), id(feats))
+    entry = _idle_faces.get(key)
+    if entry is None or entry[0] is not model or entry[1] is not feats:
+        silence = np.full((1, hp.num_mels, 16), -hp.max_abs_value, dtype=np.float32)
+        with torch.no_grad():
+            pred = model.decode(prepare_mel_batch(silence), feats)
+        entry = (model, feats, pred.cpu().numpy()[0].transpose(1, 2, 0) * 255.0)
+        _idle_faces[key] = entry
+    return entry[2]
+
+def crossfade(idle, before, after, distance_before, distance_after, fade_frames=CROSSFADE_FRAMES):
+    """Blend the idle face towards the closer speech frame near the edges of a silent run."""
+    weight, neighbour = 0.0, None
+    for frame, distance in ((before, distance_before), (after, distance_after)):
+        w = 1.0 - distance / (fade_frames + 1.0)
+        if frame is not None and w > weight:
+            weight, neighbour = w, frame
+    if neighbour is None:
+        return idle
+    return idle * (1.0 - weight) + neighbour * weight
+
+def predict_batches(model, feats, mel_batches, scheduler=None):
+    """Yield Wav2Lip predictions for an iterable of mel batch tensors (see `datagen`).
+
+    With an `InferenceScheduler`, batches are submitted so they can be merged
+    with other jobs' chunks. Only `SCHEDULER_IN_FLIGHT` batches per job are
+    queued at a time, so concurrent rooms interleave instead of waiting for
+    one job to drain; results are yielded in order.
+    """
+    if scheduler is not None:
+        futures = collections.deque()
+        for mel_batch in mel_batches:
+            futures.append(scheduler.submit(mel_batch, feats))
+            if len(futures) >= SCHEDULER_IN_FLIGHT:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+        return
+
+    for mel_batch in mel_batches:
+        with torch.no_grad():
+            yield model.decode(mel_batch, feats)
 
-def generate_lip_sync(image_path, audio_path, checkpoint_path, output_path, resize_factor=1, crop=None):
-    print("Starting lip-sync process...")
+def decode_batches(model, feats, mel_batches, scheduler=None):
+    """Yield each prediction batch as a (B, H, W, 3) float array in the 0-255 range."""
+    preds = predict_batches(model, feats, mel_batches, scheduler)
+    while True:
+        start = time.perf_counter()
+        pred = next(preds, None)
+        if pred is None:
+            return
+        faces = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.0
+        metrics.stage_seconds.observe(time.perf_counter() - start, stage="inference_batch")
+        yield faces
+
+# Busy seconds per pipeline stage and completed pipelined renders since startup
+pipeline_totals = {"runs": 0, "stages": {}}
+metrics.Callback("lipsync_pipeline_busy_seconds_total", "Busy time of each render pipeline stage.",
+                 lambda: dict(pipeline_totals["stages"]), ["stage"], kind="counter")
+
+def _record_pipeline(pipeline):
+    stats = pipeline.report()
+    pipeline_totals["runs"] += 1
+    for stage in stats["stages"]:
+        pipeline_totals["stages"][stage["name"]] = pipeline_totals["stages"].get(stage["name"], 0.0) + stage["busy"]
+
+def render_frames(image_path, audio, checkpoint_path, resize_factor=1, crop=None, batch_size=None,
+                  bundle=None, scheduler=None, max_batch_size=None, lead=0):
+    """Prepare a render of `image_path` speaking `audio` at 25 fps.
+
+    Returns (frames, (width, height), frame count), where `frames` lazily
+    yields full-size BGR uint8 frames as the model produces them. Only the
+    face box is resized and pasted into a frame buffer that is reused for
+    every frame, so each frame is overwritten by the next one; copy it to
+    keep it.
+    Unless LIPSYNC_PIPELINE=0, mel batching and the forward passes run on
+    their own threads, so the caller's resize/encode work overlaps with the
+    next batch; the mel spectrogram itself is still computed up front, as
+    silence detection and the frame count need the whole utterance.
+    `max_batch_size` caps the automatically chosen batch size, e.g. so the
+    first frames of a stream are not held back by one large forward pass.
+    `lead` adds chunks to the first batch only (see `datagen`).
+    """
     fps = 25  # Default FPS
+    img_size = 96  # Wav2Lip's expected input image size
 
-    frames = preprocess_image(image_path, resize_factor=resize_factor, crop=crop)
-    mel_chunks = preprocess_audio(audio_path, fps)
+    if bundle is not None:
+        frames = [bundle.frame]
+    else:
+        frames = preprocess_image(image_path, resize_factor=resize_factor, crop=crop)
+    mel_chunks = preprocess_audio(audio, fps)
 
-    # Load model
+    # Fetch the warm model from the registry
     model = load_model(checkpoint_path)
-
-    # Initialize video writer
+    if bundle is not None:
+        feats, box = bundle.feats, bundle.box
+    else:
+        feats = get_face_features(model, image_path, frames[0], img_size, resize_factor, crop)
+        box = get_face_box(image_path, frames[0], resize_factor, crop)
+
+    if batch_size is None:
+        batch_size = auto_batch_size(len(mel_chunks))
+        if max_batch_size is not None:
+            batch_size = min(batch_size, max_batch_size)
+    if scheduler is not None:
+        batch_size = min(batch_size, scheduler.max_batch_size)
     frame_h, frame_w = frames[0].shape[:2]
-    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (frame_w, frame_h))
-
-    img_size = 96  # Wav2Lip's expected input image size
-    gen = datagen(frames, mel_chunks, img_size)
-
-    for img_batch, mel_batch in tqdm(gen, total=len(mel_chunks), desc="Synthesizing frames"):
-        with torch.no_grad():
-            pred = model(mel_batch, img_batch)
-        pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.0
 
-        for p in pred:
-            out.write(cv2.resize(p.astype(np.uint8), (frame_w, frame_h)))
+    silent = silent_chunks(mel_chunks) if SKIP_SILENCE else np.zeros(len(mel_chunks), dtype=bool)
+    speech_chunks = mel_chunks[~silent]
+    skipped_counts["frames"] += len(mel_chunks)
+    skipped_counts["skipped"] += int(silent.sum())
+    if silent.any():
+        print(f"Skipping {int(silent.sum())} of {len(mel_chunks)} forward passes on silence.")
+
+    # Mel batches -> forward passes -> crossfade, resize and paste (in the caller, next to its encoder)
+    pipeline = Pipeline(PIPELINE_DEPTH) if PIPELINE else None
+
+    def speech_faces():
+        mel_batches = datagen(speech_chunks, batch_size, lead)
+        if pipeline is not None:
+            mel_batches = pipeline.stage("preprocess", mel_batches)
+        preds = decode_batches(model, feats, mel_batches, scheduler)
+        if pipeline is not None:
+            preds = pipeline.stage("inference", preds)
+        for pred in tqdm(preds, total=int(np.ceil(len(speech_chunks) / batch_size)), desc="Synthesizing frames"):
+            yield from pred
+
+    def faces():
+        speech = speech_faces()
+        previous, i = None, 0
+        while i < len(silent):
+            if not silent[i]:
+                previous = next(speech)
+                yield previous
+                i += 1
+                continue
+            # A silent run: idle faces, faded into the speech frames on either side
+            voiced = np.flatnonzero(~silent[i:])
+            end = i + int(voiced[0]) if len(voiced) else len(silent)
+            following = next(speech) if end < len(silent) else None
+            idle = get_idle_face(model, feats)
+            for j in range(i, end):
+                yield crossfade(idle, previous, following, j - i + 1, end - j)
+            if following is not None:
+                yield following
+                previous, end = following, end + 1
+            i = end
+
+    def generate():
+        x1, y1, x2, y2 = box
+        canvas = np.array(frames[0], dtype=np.uint8, order="C")
+        try:
+            for face in faces():
+                canvas[y1:y2, x1:x2] = cv2.resize(face.astype(np.uint8), (x2 - x1, y2 - y1))
+                yield canvas
+            if pipeline is not None and pipeline.stages:
+                pipeline.close()
+                _record_pipeline(pipeline)
+        finally:
+            if pipeline is not None:
+                pipeline.close()
+
+    return generate(), (frame_w, frame_h), len(mel_chunks)
+
+def generate_lip_sync(image_path, audio, checkpoint_path, output_path, resize_factor=1, crop=None,
+                      batch_size=None, bundle=None, scheduler=None):
+    """Render a lip-synced video of `image_path` speaking `audio`.
+
+    `audio` is a wav path, the bytes of a WAV file (e.g. TTS output) or a
+    16 kHz sample array; in-memory audio is never written to disk.
+
+    `batch_size` is the number of mel chunks per forward pass; when None it is
+    chosen by `auto_batch_size` from the utterance length and free memory.
+    When an `AvatarBundle` is given, its frame and encoder features are used
+    and `image_path` is ignored. Passing an `InferenceScheduler` batches the
+    decoder passes together with other concurrent jobs.
+    """
+    print("Starting lip-sync process...")
+    fps = 25  # Default FPS
+    frames, frame_size, _ = render_frames(image_path, audio, checkpoint_path, resize_factor, crop,
+                                          batch_size, bundle, scheduler)
 
-    out.release()
+    # Frames are piped to one ffmpeg process that muxes the audio in the same pass
+    encoder = open_encoder(output_path, frame_size, fps, audio=audio, preset=ENCODER_PRESET)
+    write_frames(encoder, frames)
     print(f"Lip-synced video saved to {output_path}")
 
-
-
-
-
-
-# import os
-# import torch
-# import numpy as np
-# import cv2
-# from glob import glob
-# from tqdm import tqdm
-# from torchvision import transforms
-# from Wav2Lip.models import Wav2Lip
-# from Wav2Lip.audio import load_wav, melspectrogram
-
-# device = 'cuda' if torch.cuda.is_available() else 'cpu'
-
-# def load_model(checkpoint_path):
-#     print("Loading model...")
-#     model = Wav2Lip()
-#     checkpoint = torch.load(checkpoint_path, map_location=device)
-#     model.load_state_dict(checkpoint['state_dict'])
-#     model = model.to(device).eval()
-#     print("Model loaded.")
-#     return model
-
-# def generate_lip_sync(face_path, audio_path, checkpoint_path, output_path):
-#     print("Processing video and audio for lip-sync...")
-
-#     # Load the face frames
-#     video_frames = []
-#     cap = cv2.VideoCapture(face_path)
-#     while True:
-#         ret, frame = cap.read()
-#         if not ret:
-#             break
-#         video_frames.append(frame)
-#     cap.release()
-#     print(f"Loaded {len(video_frames)} video frames.")
-
-#     # Load and process audio
-#     wav = load_wav(audio_path, 16000)
-#     mel = melspectrogram(wav)
-#     mel_chunks = []
-#     mel_step_size = 16
-#     mel_idx_multiplier = 80.0 / 25.0
-
-#     i = 0
-#     while 1:
-#         start_idx = int(i * mel_idx_multiplier)
-#         if start_idx + mel_step_size > mel.shape[1]:
-#             # Handle the last chunk by padding to match mel_step_size
-#             chunk = mel[:, start_idx:]
-#             chunk = np.pad(chunk, ((0, 0), (0, mel_step_size - chunk.shape[1])), mode='constant')
-#             mel_chunks.append(chunk)
-#             break
-#         mel_chunks.append(mel[:, start_idx: start_idx + mel_step_size])
-#         i += 1
-
-#     mel_chunks = np.array(mel_chunks)
-#     print(f"Generated {len(mel_chunks)} mel chunks of shape: {mel_chunks[0].shape}")
-
-
-#     # Prepare the model
-#     model = load_model(checkpoint_path)
-#     print("Loaded Wav2Lip model.")
-
-#     # Prepare output video writer
-#     frame_h, frame_w = video_frames[0].shape[:2]
-#     out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (frame_w, frame_h))
-
-#     # Generate frames
-#     for i, mel_chunk in enumerate(tqdm(mel_chunks, desc="Synthesizing frames")):
-#         mel_tensor = torch.FloatTensor(mel_chunk).unsqueeze(0).unsqueeze(0).to(device)
-#         frame_tensor = torch.FloatTensor(video_frames[i]).unsqueeze(0).permute(0, 3, 1, 2).to(device) / 255.0
-#         with torch.no_grad():
-#             pred = model(mel_tensor, frame_tensor)
-#         pred_frame = (pred[0].cpu().numpy().transpose(1, 2, 0) * 255).astype(np.uint8)
-#         out.write(pred_frame)
-
-#     out.release()
-#     print(f"Lip-synced video saved to {output_path}")
+def write_frames(encoder, frames):
+    """Feed `frames` to `encoder` and close it; returns (close() result, frame count).
+
+    Only the time spent inside the encoder is recorded as the encode stage,
+    not the rendering of the frames it consumes.
+    """
+    count, busy = 0, 0.0
+    try:
+        for frame in frames:
+            start = time.perf_counter()
+            encoder.write(frame)
+            busy += time.perf_counter() - start
+            count += 1
+    finally:
+        start = time.perf_counter()
+        result = encoder.close()
+        metrics.stage_seconds.observe(busy + time.perf_counter() - start, stage="encode")
+    return result, count
+
+def encode_segment(frames, fps, frame_size, audio=None):
+    """Encode frames (and their audio) as a standalone MP4 in memory; returns (bytes, frame count)."""
+    encoder = open_encoder(None, frame_size, fps, audio=audio, preset=ENCODER_PRESET)
+    return write_frames(encoder, frames)
+
+def stream_fragments(frames, fps, frame_size, num_frames, segment_frames, audio):
+    """Encode all frames with one ffmpeg process and yield a segment per MP4 fragment.
+
+    Keyframes are forced every `segment_frames`, so fragment i covers frames
+    [i * segment_frames, (i + 1) * segment_frames). Frames are written on a
+    separate thread, so each fragment is yielded as soon as ffmpeg finishes
+    it rather than when the next frame is rendered.
+    """
+    encoder = FFmpegEncoder(None, frame_size, fps, audio=audio, preset=ENCODER_PRESET,
+                            fragmented=True, keyframe_interval=segment_frames)
+    stop = threading.Event()
+    errors = []
+
+    def feed():
+        try:
+            busy = 0.0
+            for frame in frames:
+                if stop.is_set():
+                    encoder.abort()
+                    return
+                start = time.perf_counter()
+                encoder.write(frame)
+                busy += time.perf_counter() - start
+            start = time.perf_counter()
+            encoder.close()
+            metrics.stage_seconds.observe(busy + time.perf_counter() - start, stage="encode")
+        except Exception as e:
+            errors.append(e)
+            encoder.abort()
+        finally:
+            frames.close()  # stops the render pipeline if the stream was abandoned
+            encoder.fragments.put(None)
+
+    writer = threading.Thread(target=feed, name="lipsync-encode", daemon=True)
+    writer.start()
+    try:
+        for index in itertools.count():
+            video = encoder.fragments.get()
+            if video is None:
+                break
+            first_frame = index * segment_frames
+            count = max(0, min(segment_frames, num_frames - first_frame))
+            yield {"index": index, "start": first_frame / fps, "duration": count / fps, "video": video}
+    finally:
+        stop.set()
+        writer.join()
+    if errors:
+        raise errors[0]
+
+def generate_lip_sync_stream(image_path, audio, checkpoint_path, segment_seconds=SEGMENT_SECONDS,
+                             resize_factor=1, crop=None, batch_size=None, bundle=None, scheduler=None):
+    """Like `generate_lip_sync`, but yield the video in fixed-duration segments while rendering.
+
+    Each segment is a dict with `index`, `start` and `duration` (seconds) and
+    `video`. With ffmpeg, the whole utterance goes through one encoder that
+    writes fragmented MP4 and each segment is one fragment: the first carries
+    the init segment, and appending them in order (e.g. to a MediaSource
+    buffer) plays the video with its audio. Concatenated, they form the
+    complete MP4. Without ffmpeg every segment is a standalone silent MP4.
+    Unless `batch_size` is given, forward passes are capped at one segment
+    of frames so segments are produced at a steady pace. ffmpeg closes a
+    fragment when the next segment's first frame arrives, so the first pass
+    renders one extra frame and every pass then ends on that frame.
+    """
+    print("Starting streaming lip-sync process...")
+    fps = 25  # Default FPS
+    segment_frames = max(1, int(round(segment_seconds * fps)))
+    with metrics.stage("audio_decode"):
+        wav = load_audio(audio, 16000)
+    frames, frame_size, num_frames = render_frames(image_path, wav, checkpoint_path, resize_factor, crop,
+                                                   batch_size, bundle, scheduler, max_batch_size=segment_frames,
+                                                   lead=1 if ffmpeg_binary() is not None else 0)
+
+    if ffmpeg_binary() is not None:
+        yield from stream_fragments(frames, fps, frame_size, num_frames, segment_frames, wav)
+    else:
+        for index in itertools.count():
+            first = next(frames, None)
+            if first is None:
+                break
+            segment = itertools.chain([first], itertools.islice(frames, segment_frames - 1))
+            video, count = encode_segment(segment, fps, frame_size)
+            yield {"index": index, "start": index * segment_frames / fps, "duration": count / fps, "video": video}
+    print(f"Streamed {num_frames} frames in {int(np.ceil(num_frames / segment_frames))} segments.")
@@ -0,0 +1,237 @@
+"""Worker pool that keeps lip-sync rendering off the asyncio event loop.
+
+`generate_lip_sync` is synchronous and CPU heavy. Socket.IO handlers await
+`run_lip_sync` instead, which hands the job to a bounded thread or process
+pool so other rooms keep receiving events while videos render.
+`stream_lip_sync` does the same for `generate_lip_sync_stream` and yields
+video segments as the worker produces them.
+
+Configuration (environment variables):
+    LIPSYNC_EXECUTOR       "thread" (default) or "process"
+    LIPSYNC_WORKERS        number of concurrent renders (default 2)
+    LIPSYNC_TORCH_THREADS  intra-op torch threads per worker (default: cores // workers)
+    LIPSYNC_MAX_PENDING    renders queued or running before callers wait (default 16)
+    LIPSYNC_PRECISION_CONFIG  JSON file mapping avatar_id (or "default") to "fp32" or "int8"
+    WAV2LIP_INT8_CHECKPOINT   int8 archive produced by `python -m Wav2Lip.quantize`
+    WAV2LIP_GRAPH_CHECKPOINT  optional compiled fp32 graph from `python -m Wav2Lip.export_graph`
+                              (.pt for TorchScript, .onnx for onnxruntime) used instead of eager
+"""
+import os
+import json
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import torch
+
+from router.lip_sync import generate_lip_sync, generate_lip_sync_stream, load_model, device
+from router.avatar_bundle import load_bundles, get_bundle
+from router.inference_scheduler import LIPSYNC_SCHEDULER, get_scheduler
+from router import metrics
+
+LIPSYNC_EXECUTOR = os.getenv("LIPSYNC_EXECUTOR", "thread")
+LIPSYNC_WORKERS = int(os.getenv("LIPSYNC_WORKERS", "2"))
+LIPSYNC_TORCH_THREADS = int(os.getenv("LIPSYNC_TORCH_THREADS", "0"))
+LIPSYNC_MAX_PENDING = int(os.getenv("LIPSYNC_MAX_PENDING", "16"))
+LIPSYNC_PRECISION_CONFIG = os.getenv("LIPSYNC_PRECISION_CONFIG", "static/precision.json")
+WAV2LIP_INT8_CHECKPOINT = os.getenv("WAV2LIP_INT8_CHECKPOINT", "Wav2Lip/checkpoints/wav2lip_gan_int8.pt")
+WAV2LIP_GRAPH_CHECKPOINT = os.getenv("WAV2LIP_GRAPH_CHECKPOINT", "")
+
+_executor = None
+_manager = None
+_segment_reader = None
+_semaphore = None
+_precision = None
+
+renders_in_flight = metrics.Gauge("lipsync_pool_renders", "Renders waiting for or running in the worker pool.")
+
+
+def load_precision_config():
+    """Read the per-avatar precision map, e.g. {"default": "fp32", "12": "int8"}."""
+    global _precision
+    _precision = {}
+    if os.path.exists(LIPSYNC_PRECISION_CONFIG):
+        with open(LIPSYNC_PRECISION_CONFIG) as f:
+            _precision = {str(k): v for k, v in json.load(f).items()}
+    return _precision
+
+
+def fp32_checkpoint(checkpoint_path):
+    """The compiled fp32 graph when one is configured, otherwise the eager checkpoint."""
+    if WAV2LIP_GRAPH_CHECKPOINT and device == 'cpu':
+        return WAV2LIP_GRAPH_CHECKPOINT
+    return checkpoint_path
+
+
+def checkpoint_for_avatar(avatar_id, checkpoint_path):
+    """Pick the fp32 checkpoint or the int8 archive according to the precision config."""
+    config = _precision if _precision is not None else load_precision_config()
+    precision = config.get(str(avatar_id), config.get("default", "fp32"))
+    if precision != "int8":
+        return fp32_checkpoint(checkpoint_path)
+    if device != 'cpu' or not os.path.exists(WAV2LIP_INT8_CHECKPOINT):
+        print(f"int8 requested for avatar {avatar_id} but unavailable on {device}; using fp32.")
+        return fp32_checkpoint(checkpoint_path)
+    return WAV2LIP_INT8_CHECKPOINT
+
+
+def preload_models(checkpoint_path):
+    """Load the fp32 model (eager and compiled) and, if any avatar uses it, the int8 archive."""
+    load_model(checkpoint_path)
+    if fp32_checkpoint(checkpoint_path) != checkpoint_path:
+        load_model(fp32_checkpoint(checkpoint_path))
+    config = load_precision_config()
+    if "int8" in config.values() and device == 'cpu' and os.path.exists(WAV2LIP_INT8_CHECKPOINT):
+        load_model(WAV2LIP_INT8_CHECKPOINT)
+
+
+def torch_threads_per_worker():
+    if LIPSYNC_TORCH_THREADS > 0:
+        return LIPSYNC_TORCH_THREADS
+    return max(1, (os.cpu_count() or 1) // max(1, LIPSYNC_WORKERS))
+
+
+def configure_torch_threads(num_threads):
+    """Size the intra-op (oneDNN/OpenMP) pool; inference never needs inter-op parallelism."""
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before the first parallel op in this process
+        pass
+
+
+def _init_worker(checkpoint_path, num_threads):
+    """Process-pool initializer: pin torch threads and warm the model and bundles."""
+    configure_torch_threads(num_threads)
+    preload_models(checkpoint_path)
+    load_bundles(checkpoint_path)
+
+
+def _render(image_path, audio, checkpoint_path, output_path, avatar_id=None, **kwargs):
+    bundle = get_bundle(avatar_id) if avatar_id is not None else None
+    checkpoint_path = checkpoint_for_avatar(avatar_id, checkpoint_path)
+    scheduler = get_scheduler(checkpoint_path) if LIPSYNC_SCHEDULER else None
+    generate_lip_sync(image_path, audio, checkpoint_path, output_path, bundle=bundle,
+                      scheduler=scheduler, **kwargs)
+    return output_path
+
+
+def _render_stream(segments, image_path, audio, checkpoint_path, avatar_id=None, **kwargs):
+    """Put each rendered segment on `segments`, then None (or the exception that stopped the render)."""
+    try:
+        bundle = get_bundle(avatar_id) if avatar_id is not None else None
+        checkpoint_path = checkpoint_for_avatar(avatar_id, checkpoint_path)
+        scheduler = get_scheduler(checkpoint_path) if LIPSYNC_SCHEDULER else None
+        for segment in generate_lip_sync_stream(image_path, audio, checkpoint_path, bundle=bundle,
+                                                scheduler=scheduler, **kwargs):
+            segments.put(segment)
+    except Exception as e:
+        segments.put(e)
+        return
+    segments.put(None)
+
+
+class _LoopQueue:
+    """Queue a worker thread puts into and the event loop awaits, without a thread blocked in get."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+def _segment_queue(loop):
+    """Return (queue the worker puts segments on, coroutine function awaiting the next one).
+
+    Thread workers hand segments to the loop directly. Process workers write to a
+    manager queue; its blocking gets run on a dedicated pool with one thread per
+    admitted render (LIPSYNC_MAX_PENDING), not on the default executor that
+    asyncio.to_thread uses for TTS and cache I/O.
+    """
+    global _manager, _segment_reader
+    if LIPSYNC_EXECUTOR != "process":
+        segments = _LoopQueue(loop)
+        return segments, segments.queue.get
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+    if _segment_reader is None:
+        _segment_reader = ThreadPoolExecutor(max_workers=LIPSYNC_MAX_PENDING, thread_name_prefix="lipsync-segments")
+    segments = _manager.Queue()
+    return segments, functools.partial(loop.run_in_executor, _segment_reader, segments.get)
+
+
+def start_pool(checkpoint_path):
+    """Create the executor. Safe to call more than once."""
+    global _executor
+    if _executor is not None:
+        return _executor
+
+    num_threads = torch_threads_per_worker()
+    if LIPSYNC_EXECUTOR == "process":
+        # Workers load their own model copy; spawn avoids forking a process with OpenMP state
+        _executor = ProcessPoolExecutor(max_workers=LIPSYNC_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker,
+                                        initargs=(checkpoint_path, num_threads))
+    else:
+        # Threads share the resident model; torch releases the GIL inside its kernels
+        configure_torch_threads(num_threads)
+        _executor = ThreadPoolExecutor(max_workers=LIPSYNC_WORKERS, thread_name_prefix="lipsync")
+
+    print(f"Lip-sync pool started: {LIPSYNC_WORKERS} {LIPSYNC_EXECUTOR} worker(s), "
+          f"{num_threads} torch thread(s) each.")
+    return _executor
+
+
+def shutdown_pool():
+    global _executor, _manager, _segment_reader
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _segment_reader is not None:
+        _segment_reader.shutdown(wait=False, cancel_futures=True)
+        _segment_reader = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+
+async def run_lip_sync(image_path, audio, checkpoint_path, output_path, avatar_id=None, **kwargs):
+    """Render a lip-synced video in the worker pool and return `output_path` when done."""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LIPSYNC_MAX_PENDING)
+
+    executor = start_pool(checkpoint_path)
+    job = functools.partial(_render, image_path, audio, checkpoint_path, output_path,
+                            avatar_id=avatar_id, **kwargs)
+    with renders_in_flight.track():
+        async with _semaphore:
+            return await asyncio.get_running_loop().run_in_executor(executor, job)
+
+
+async def stream_lip_sync(image_path, audio, checkpoint_path, avatar_id=None, **kwargs):
+    """Render in the worker pool and yield video segments (see `generate_lip_sync_stream`) as they finish."""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LIPSYNC_MAX_PENDING)
+
+    executor = start_pool(checkpoint_path)
+    loop = asyncio.get_running_loop()
+    segments, next_segment = _segment_queue(loop)
+    job = functools.partial(_render_stream, segments, image_path, audio, checkpoint_path,
+                            avatar_id=avatar_id, **kwargs)
+    with renders_in_flight.track():
+        async with _semaphore:
+            render = loop.run_in_executor(executor, job)
+            while True:
+                segment = await next_segment()
+                if segment is None:
+                    break
+                if isinstance(segment, Exception):
+                    raise segment
+                yield segment
+            await render
@@ -0,0 +1,356 @@
+"""REST API for rendering lip-sync videos outside of a Socket.IO room.
+
+POST /lipsync/jobs queues a job (text to speech, then lip-sync), GET
+/lipsync/jobs/{job_id} reports its status and GET /lipsync/jobs/{job_id}/result
+downloads the MP4 once it is done. Jobs wait in an in-process priority queue
+and at most LIPSYNC_JOB_CONCURRENCY of them render at a time, so pre-rendering
+or load tests leave worker capacity for live rooms. Finished jobs are kept
+for LIPSYNC_JOB_RETENTION_SECONDS; their videos go to the artifact store
+(router/artifact_store.py), which bounds them by size and age.
+
+Jobs with an avatar_id render that avatar: its bundle if one is loaded,
+otherwise a local copy of its avatar_img from tbl_aiterp_Avatars. Jobs with
+only a voice_code render the default face. Each avatar keeps one image copy,
+deleted once no job has used it for LIPSYNC_JOB_RETENTION_SECONDS.
+
+Configuration (environment variables):
+    LIPSYNC_JOB_CONCURRENCY        jobs rendering at once (default 1)
+    LIPSYNC_JOB_MAX_QUEUED         queued jobs before submissions get 429 (default 100)
+    LIPSYNC_JOB_RETENTION_SECONDS  how long finished jobs and unused avatar images are kept (default 3600)
+    LIPSYNC_JOB_DIR                where avatar image copies are kept (default static/output/jobs)
+"""
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import itertools
+import threading
+import cv2
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from models.lipsync_job import LipSyncJobRequest, LipSyncJobResponse
+from db import get_db_connection, pyodbc
+from router.socket_server import synthesize_speech, utterance_cache_key, LOCAL_MODEL_PATH
+from router.lip_sync_pool import run_lip_sync
+from router.utterance_cache import cache as utterance_cache
+from router.avatar_bundle import get_bundle, load_avatar_image
+from router.artifact_store import store as artifact_store
+from Wav2Lip.audio import decode_wav
+from router import metrics
+
+LIPSYNC_JOB_CONCURRENCY = int(os.getenv("LIPSYNC_JOB_CONCURRENCY", "1"))
+LIPSYNC_JOB_MAX_QUEUED = int(os.getenv("LIPSYNC_JOB_MAX_QUEUED", "100"))
+LIPSYNC_JOB_RETENTION_SECONDS = float(os.getenv("LIPSYNC_JOB_RETENTION_SECONDS", "3600"))
+LIPSYNC_JOB_DIR = os.getenv("LIPSYNC_JOB_DIR", "static/output/jobs")
+FACE_DIR = os.path.join(LIPSYNC_JOB_DIR, "faces")
+
+# Seconds between purges of expired jobs and unused avatar images, with or without API traffic
+PURGE_INTERVAL = 60
+
+# Same default face as the transcription handler, for jobs without an avatar_id
+DEFAULT_FACE_PATH = "static/faces/es.jpg"
+
+router = APIRouter()
+
+
+class LipSyncJob:
+    def __init__(self, request, voice_code, avatar_img=None):
+        self.job_id = uuid.uuid4().hex
+        self.request = request
+        self.voice_code = voice_code
+        self.avatar_img = avatar_img
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.artifact = None  # name of the video in the artifact store once completed
+
+    @property
+    def expires_at(self):
+        if self.finished_at is None:
+            return None
+        return self.finished_at + LIPSYNC_JOB_RETENTION_SECONDS
+
+    def to_response(self, result_url=None):
+        return LipSyncJobResponse(
+            job_id=self.job_id,
+            status=self.status,
+            priority=self.request.priority,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            expires_at=self.expires_at,
+            error=self.error,
+            result_url=result_url if self.status == "completed" else None,
+        )
+
+
+class JobQueue:
+    """Priority queue of `LipSyncJob`s drained by a fixed number of asyncio workers."""
+
+    def __init__(self, concurrency=LIPSYNC_JOB_CONCURRENCY, max_queued=LIPSYNC_JOB_MAX_QUEUED):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.jobs = {}
+        self._queue = None  # created on first use, inside the running event loop
+        self._workers = []
+        self._purger = None
+        self._sequence = itertools.count()
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+            self._purger = asyncio.create_task(self._purge_periodically())
+
+    def submit(self, request, voice_code, avatar_img=None):
+        """Queue a job; returns None when the queue is full."""
+        self.purge()
+        self._start()
+        if self.count("queued") >= self.max_queued:
+            return None
+        job = LipSyncJob(request, voice_code, avatar_img)
+        self.jobs[job.job_id] = job
+        self._queue.put_nowait((-request.priority, next(self._sequence), job))
+        return job
+
+    def get(self, job_id):
+        self.purge()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started yet; returns the job, or None if unknown."""
+        job = self.get(job_id)
+        if job is not None and job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return job
+
+    def purge(self):
+        """Forget finished jobs past their retention; the artifact store expires their videos."""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.expires_at is not None and job.expires_at < now:
+                del self.jobs[job_id]
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(PURGE_INTERVAL)
+            self.purge()
+            await asyncio.to_thread(purge_faces)
+
+    def count(self, status):
+        return sum(1 for job in self.jobs.values() if job.status == status)
+
+    def stats(self):
+        """Number of retained jobs per status."""
+        counts = {status: 0 for status in ("queued", "running", "completed", "failed", "cancelled")}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return counts
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status != "queued":
+                continue  # cancelled while waiting
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                await render_job(job)
+                job.status = "completed"
+            except Exception as e:
+                print(f"Lip-sync job {job.job_id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            job.finished_at = time.time()
+
+    def shutdown(self):
+        for task in self._workers + [self._purger]:
+            if task is not None:
+                task.cancel()
+        self._workers = []
+        self._purger = None
+        self._queue = None
+
+
+def get_avatar(avatar_id):
+    """Return (voice_code, avatar_img) for the avatar, or None."""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT voice_code, avatar_img FROM tbl_aiterp_Avatars WHERE avatar_id = ?", avatar_id)
+            result = cursor.fetchone()
+            return (result[0], result[1]) if result else None
+    except pyodbc.Error as e:
+        print(f"Database error: {e}")
+        return None
+
+
+# Last time each avatar image copy was used, keyed by path; the lock keeps purges off copies being handed out
+_face_used = {}
+_face_lock = threading.Lock()
+
+
+def avatar_face_path(avatar_id, avatar_img):
+    """Local copy of an avatar image, for avatars rendered without a bundle.
+
+    The file is named after `avatar_img`, so it is fetched once and a changed
+    image gets a new file (and new utterance cache keys); the avatar's older
+    copies are deleted.
+    """
+    digest = hashlib.sha256(avatar_img.encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(FACE_DIR, f"{avatar_id}_{digest}.png")
+    with _face_lock:
+        _face_used[path] = time.time()
+        if os.path.exists(path):
+            return path
+    frame = load_avatar_image(avatar_img)
+    os.makedirs(FACE_DIR, exist_ok=True)
+    tmp_path = os.path.join(FACE_DIR, f"{uuid.uuid4().hex}.tmp.png")
+    cv2.imwrite(tmp_path, frame)
+    with _face_lock:
+        os.replace(tmp_path, path)
+        _face_used[path] = time.time()
+        for name in os.listdir(FACE_DIR):
+            if name.startswith(f"{avatar_id}_") and name != os.path.basename(path):
+                _remove_face(os.path.join(FACE_DIR, name))
+    return path
+
+
+def purge_faces(max_age=LIPSYNC_JOB_RETENTION_SECONDS):
+    """Delete avatar image copies no job has used for `max_age` seconds.
+
+    Copies from before a restart count from their modification time.
+    """
+    if not os.path.isdir(FACE_DIR):
+        return
+    cutoff = time.time() - max_age
+    with _face_lock:
+        for name in os.listdir(FACE_DIR):
+            path = os.path.join(FACE_DIR, name)
+            try:
+                used = _face_used.get(path) or os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if used < cutoff:
+                _remove_face(path)
+
+
+def _remove_face(path):
+    _face_used.pop(path, None)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def store_job_video(cache_key, path, audio_data):
+    """Cache the video rendered to `path`, then move it into the artifact store; returns its name."""
+    with open(path, "rb") as f:
+        video_data = f.read()
+    samples, sample_rate = decode_wav(audio_data)
+    utterance_cache.put_video(cache_key, [{'start': 0.0, 'duration': len(samples) / sample_rate, 'video': video_data}])
+    return artifact_store.put_file(path, ".mp4")
+
+
+async def render_job(job):
+    """Synthesize the job's text, render it and store the video as `job.artifact`, using the utterance cache.
+
+    Speech synthesis, image downloads and cache or file I/O run in threads, so
+    a job never stalls the event loop shared with the Socket.IO rooms.
+    """
+    request = job.request
+    image_path = DEFAULT_FACE_PATH
+    if job.avatar_img and get_bundle(request.avatar_id) is None:
+        image_path = await asyncio.to_thread(avatar_face_path, request.avatar_id, job.avatar_img)
+
+    cache_key = utterance_cache_key(request.text, request.language, job.voice_code, request.avatar_id, image_path)
+    cached = await asyncio.to_thread(utterance_cache.get, cache_key)
+    # Streamed renders are cached as several segments; only a single-segment entry is a full video
+    if cached is not None and cached.segments and len(cached.segments) == 1:
+        job.artifact = await asyncio.to_thread(artifact_store.put, cached.segments[0]["video"], ".mp4")
+        return
+
+    if cached is not None:
+        audio_data = cached.audio
+    else:
+        audio_data = await synthesize_speech(request.text, job.voice_code, request.language)
+        if not audio_data:
+            raise RuntimeError("Speech synthesis failed.")
+        await asyncio.to_thread(utterance_cache.put_audio, cache_key, audio_data)
+
+    output_path = artifact_store.temp_path(".mp4")
+    try:
+        await run_lip_sync(image_path, audio_data, LOCAL_MODEL_PATH, output_path, avatar_id=request.avatar_id)
+        job.artifact = await asyncio.to_thread(store_job_video, cache_key, output_path, audio_data)
+    finally:
+        # Already gone once put_file has moved it into the store
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+
+jobs = JobQueue()
+
+metrics.Callback("lipsync_jobs", "Retained lip-sync jobs by status.", jobs.stats, ["status"])
+
+
+def job_response(request, job):
+    return job.to_response(str(request.url_for("get_lipsync_job_result", job_id=job.job_id)))
+
+
+@router.post("", response_model=LipSyncJobResponse, status_code=202)
+async def submit_lipsync_job(job_request: LipSyncJobRequest, request: Request):
+    if not job_request.text.strip():
+        raise HTTPException(status_code=422, detail="text must not be empty")
+    if job_request.voice_code is None and job_request.avatar_id is None:
+        raise HTTPException(status_code=422, detail="Either voice_code or avatar_id is required")
+    voice_code, avatar_img = job_request.voice_code, None
+    if job_request.avatar_id is not None:
+        avatar = await asyncio.to_thread(get_avatar, job_request.avatar_id)
+        if avatar is None:
+            raise HTTPException(status_code=422, detail=f"Avatar {job_request.avatar_id} not found")
+        voice_code = voice_code or avatar[0]
+        avatar_img = avatar[1]
+        if not avatar_img and get_bundle(job_request.avatar_id) is None:
+            raise HTTPException(status_code=422,
+                                detail=f"Avatar {job_request.avatar_id} has no bundle and no avatar_img")
+    if not voice_code:
+        raise HTTPException(status_code=422, detail=f"No voice code found for avatar {job_request.avatar_id}")
+    job = jobs.submit(job_request, voice_code, avatar_img)
+    if job is None:
+        raise HTTPException(status_code=429, detail=f"Job queue is full ({jobs.max_queued} jobs waiting)")
+    return job_response(request, job)
+
+
+@router.get("/{job_id}", response_model=LipSyncJobResponse)
+async def get_lipsync_job(job_id: str, request: Request):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_response(request, job)
+
+
+@router.get("/{job_id}/result")
+async def get_lipsync_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+    path = artifact_store.path(job.artifact)
+    if path is None:
+        raise HTTPException(status_code=410, detail=f"The video of job {job_id} has been evicted from the artifact store")
+    return FileResponse(path, media_type="video/mp4", filename=f"{job_id}.mp4")
+
+
+@router.delete("/{job_id}", response_model=LipSyncJobResponse)
+async def cancel_lipsync_job(job_id: str, request: Request):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job.status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status} and can no longer be cancelled")
+    return job_response(request, job)
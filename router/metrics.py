@@ -0,0 +1,226 @@
+"""In-process metrics in the Prometheus text format, served by main.py at /metrics.
+
+Counters, gauges and histograms are plain Python objects updated under a
+lock, so recording a sample costs a dict lookup and a few additions. State
+owned by other modules (cache sizes, queue depths, loaded models) is read by
+callbacks only when /metrics is scraped.
+
+Stage timings go to `lipsync_stage_seconds{stage=...}`:
+    db_lookup        avatar/voice lookup for a room
+    tts              Azure speech synthesis
+    audio_decode     WAV parsing and resampling
+    mel              mel spectrogram and window split for an utterance
+    inference_batch  one Wav2Lip forward pass, including the copy back to numpy
+    encode           ffmpeg encoding of one video or stream segment
+    emit             one Socket.IO video event
+
+With LIPSYNC_EXECUTOR=process the render stages are recorded in the worker
+processes and do not show up here.
+"""
+import time
+import asyncio
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond stages up to long renders
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Unlabelled metrics report 0 until the first update
+        self._values = {} if self.labelnames or self.kind == "histogram" else {(): 0}
+        with _lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        with _lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count; the name should end in _total."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down."""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in progress."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the enclosed block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with _lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append((self.name + "_sum", key, (), total))
+            samples.append((self.name + "_count", key, (), cumulative))
+        return samples
+
+
+class Callback(_Metric):
+    """Gauge or counter read from `function` at scrape time.
+
+    `function` returns a number, or a dict mapping label values (a tuple, or
+    a single value for one label) to numbers.
+    """
+
+    def __init__(self, name, documentation, function, labelnames=(), kind="gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.function = function
+
+    def samples(self):
+        try:
+            values = self.function()
+        except Exception as e:
+            print(f"Metric {self.name} could not be collected: {e}")
+            return []
+        if not isinstance(values, dict):
+            return [(self.name, (), (), values)]
+        return [(self.name, key if isinstance(key, tuple) else (key,), (), value) for key, value in values.items()]
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    with _lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+stage_seconds = Histogram("lipsync_stage_seconds", "Time spent in each lip-sync stage.", ["stage"])
+transcription_seconds = Histogram("lipsync_transcription_seconds",
+                                  "Time from a transcription event to the last video event.", ["outcome"])
+event_loop_lag_seconds = Histogram("lipsync_event_loop_lag_seconds",
+                                   "Delay of a timer on the asyncio event loop beyond its deadline.",
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+def stage(name):
+    """Time a block as `lipsync_stage_seconds{stage=name}`."""
+    return stage_seconds.time(stage=name)
+
+
+# Sampling period of the event-loop lag monitor, in seconds
+EVENT_LOOP_LAG_INTERVAL = 0.5
+
+_lag_monitor = None
+
+
+async def _monitor_event_loop(interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - start - interval))
+
+
+def start_event_loop_monitor(interval=EVENT_LOOP_LAG_INTERVAL):
+    """Start sampling event-loop lag on the running loop. Safe to call more than once."""
+    global _lag_monitor
+    if _lag_monitor is None or _lag_monitor.done():
+        _lag_monitor = asyncio.get_running_loop().create_task(_monitor_event_loop(interval))
+
+
+def stop_event_loop_monitor():
+    global _lag_monitor
+    if _lag_monitor is not None:
+        _lag_monitor.cancel()
+        _lag_monitor = None
@@ -0,0 +1,152 @@
+"""Thread pipeline with bounded queues between stages.
+
+Each stage is a generator that consumes the previous stage's output. It runs
+on its own thread and hands items downstream through a bounded queue, so
+the stages work concurrently while memory stays bounded by the queue depth.
+For lip-sync this lets one batch's frames be resized and encoded while the
+model already runs the next batch. The last stage runs on the caller's
+thread.
+
+Per stage, the pipeline reports utilization (time spent producing items,
+excluding time waiting for input or for room downstream) and the queue
+depth seen at each hand-off.
+"""
+import time
+import queue
+import threading
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class Stage:
+    """One producer thread feeding a bounded queue; iterate it to consume."""
+
+    def __init__(self, pipeline, name, iterable, depth):
+        self.pipeline = pipeline
+        self.name = name
+        self.depth = depth
+        self.queue = queue.Queue(depth)
+        self.items = 0
+        self.produce_time = 0.0  # time inside the upstream iterator, including waits on its own input
+        self.put_wait = 0.0      # time blocked because the queue was full
+        self.get_wait = 0.0      # time the consumer spent waiting on this queue
+        self.depth_total = 0     # queue occupancy seen at each hand-off
+        self.depth_max = 0
+        self.upstream = iterable if isinstance(iterable, Stage) else None
+        self._thread = threading.Thread(target=self._run, args=(iter(iterable),), daemon=True,
+                                        name=f"pipeline-{name}")
+        self._thread.start()
+
+    def _put(self, item):
+        start = time.perf_counter()
+        while not self.pipeline.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.put_wait += time.perf_counter() - start
+
+    def _run(self, iterator):
+        try:
+            while not self.pipeline.closed.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.produce_time += time.perf_counter() - start
+                depth = self.queue.qsize()
+                self.depth_total += depth
+                self.depth_max = max(self.depth_max, depth)
+                self.items += 1
+                self._put(item)
+        except Exception as e:
+            self._put(_Failure(e))
+            return
+        self._put(_DONE)
+
+    def __iter__(self):
+        while True:
+            start = time.perf_counter()
+            item = _DONE
+            while not self.pipeline.closed.is_set():
+                try:
+                    item = self.queue.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    continue
+            self.get_wait += time.perf_counter() - start
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+    @property
+    def busy_time(self):
+        # Time spent waiting for upstream items is counted by the upstream stage's get_wait
+        upstream_wait = self.upstream.get_wait if self.upstream is not None else 0.0
+        return max(0.0, self.produce_time - upstream_wait)
+
+
+class Pipeline:
+    """Builds a chain of `Stage`s and reports their utilization once the caller is done."""
+
+    def __init__(self, depth=2):
+        self.depth = depth
+        self.stages = []
+        self.closed = threading.Event()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def stage(self, name, iterable):
+        """Run `iterable` (usually a generator over the previous stage) on its own thread."""
+        if not self.stages:
+            self.started = time.perf_counter()
+        stage = Stage(self, name, iterable, self.depth)
+        self.stages.append(stage)
+        return stage
+
+    def close(self):
+        """Stop all stage threads; safe to call more than once."""
+        if self.finished is None:
+            self.finished = time.perf_counter()
+        self.closed.set()
+
+    def stats(self, final_stage="encode"):
+        """Utilization per stage and queue depth per hand-off; the caller's loop is `final_stage`."""
+        elapsed = max(1e-9, (self.finished or time.perf_counter()) - self.started)
+        stats = {"elapsed": elapsed, "stages": []}
+        for stage in self.stages:
+            stats["stages"].append({
+                "name": stage.name,
+                "items": stage.items,
+                "busy": stage.busy_time,
+                "utilization": stage.busy_time / elapsed,
+                "blocked": stage.put_wait,
+                "queue_depth_mean": stage.depth_total / stage.items if stage.items else 0.0,
+                "queue_depth_max": stage.depth_max,
+            })
+        if self.stages:
+            last = self.stages[-1]
+            busy = max(0.0, elapsed - last.get_wait)
+            stats["stages"].append({"name": final_stage, "items": last.items, "busy": busy,
+                                    "utilization": busy / elapsed})
+        return stats
+
+    def report(self, final_stage="encode"):
+        stats = self.stats(final_stage)
+        parts = []
+        for s in stats["stages"]:
+            part = f"{s['name']} {100 * s['utilization']:.0f}% busy"
+            if "queue_depth_mean" in s:
+                part += f" (queue {s['queue_depth_mean']:.1f} avg/{s['queue_depth_max']} max of {self.depth})"
+            parts.append(part)
+        print(f"Pipeline {stats['elapsed']:.2f}s: " + ", ".join(parts))
+        return stats
@@ -1,6 +1,8 @@
 import io
 import base64
 import os
+import time
+import asyncio
 from azure.storage.blob import BlobServiceClient
 import socketio
 from db import get_db_connection, pyodbc
@@ -8,6 +10,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from azure.cognitiveservices.speech import SpeechConfig, SpeechSynthesizer, AudioDataStream, SpeechSynthesisOutputFormat, ResultReason
 from router.lip_sync import generate_lip_sync, load_model  
+from router.avatar_bundle import load_bundles, get_bundle
+from router.lip_sync_pool import run_lip_sync, stream_lip_sync, start_pool, preload_models, checkpoint_for_avatar
+from router.utterance_cache import cache as utterance_cache, utterance_key, file_id
+from router.artifact_store import store as artifact_store
+from router import metrics
+from Wav2Lip.audio import decode_wav
+from Wav2Lip.runtime import onnx_paths
 
 # Create FastAPI app
 app = FastAPI()
@@ -21,39 +30,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Audio and video are sent as binary attachments; "1" restores base64 strings for old clients
+SOCKET_LEGACY_BASE64 = os.getenv("SOCKET_LEGACY_BASE64", "0") == "1"
+# "msgpack" packs events with msgpack (needs the msgpack package and socket.io-msgpack-parser on clients)
+SOCKET_SERIALIZER = os.getenv("SOCKET_SERIALIZER", "default")
+
 # Create a new Socket.IO server
-sio = socketio.AsyncServer(cors_allowed_origins='*', async_mode='asgi')
+sio = socketio.AsyncServer(cors_allowed_origins='*', async_mode='asgi', serializer=SOCKET_SERIALIZER)
 
 # Wrap the Socket.IO server with the ASGI app
 socket_app = socketio.ASGIApp(sio, other_asgi_app=app)
 
+# "url" puts videos in the artifact store and sends their /artifacts URL; "inline" sends the bytes.
+# SOCKET_LEGACY_BASE64=1 always sends inline base64, so it still restores the old events on its own
+SOCKET_MEDIA_DELIVERY = "inline" if SOCKET_LEGACY_BASE64 else os.getenv("SOCKET_MEDIA_DELIVERY", "url")
+
+# "1" sends lip-sync video as lipSyncChunk segments while it renders (clients must handle
+# lipSyncChunk/lipSyncEnd); by default one lipSyncComplete is sent, which test.html listens for
+LIPSYNC_STREAMING = os.getenv("LIPSYNC_STREAMING", "0") == "1"
+
 # Initialize rooms dictionary
 rooms = {}
 # Track microphone holder for each room
 mic_holders = {}
 
+metrics.Callback("lipsync_active_rooms", "Rooms with at least one client.", lambda: len(rooms))
+metrics.Callback("lipsync_room_clients", "Clients joined to a room.", lambda: sum(len(c) for c in list(rooms.values())))
+
 # Azure Speech Configurations
 speech_config = SpeechConfig(subscription="a446630e73514d779093ab5621f15304", region="eastus")
 speech_config.set_speech_synthesis_output_format(SpeechSynthesisOutputFormat.Riff16Khz16BitMonoPcm)
 
-# Function to synthesize speech with voice_code
+def media_payload(data):
+    """Raw bytes for a binary attachment, or a base64 string in legacy mode."""
+    if SOCKET_LEGACY_BASE64:
+        return base64.b64encode(data).decode('utf-8')
+    return bytes(data)
+
+def video_fields(data):
+    """Event fields for a video: {'url': ...} pointing at the artifact store, or {'video': bytes}."""
+    if SOCKET_MEDIA_DELIVERY == "url":
+        return {'url': artifact_store.url(artifact_store.put(data, ".mp4"))}
+    return {'video': media_payload(data)}
+
+async def emit_video(event, fields, data, room_code):
+    """Emit a video event; the time, including the artifact store write, is the emit stage.
+
+    `data` is None when `fields` already carry the video (see `store_rendered_video`).
+    """
+    with metrics.stage("emit"):
+        if data is not None:
+            # Hashing and writing the artifact is disk work; keep it off the event loop
+            fields = {**fields, **await asyncio.to_thread(video_fields, data)}
+        await sio.emit(event, fields, room=room_code)
+
+def store_rendered_video(cache_key, path, audio_data):
+    """Cache the video rendered to `path` and return its event fields.
+
+    In url mode the file itself is moved into the artifact store with `put_file`.
+    """
+    with open(path, "rb") as f:
+        video_data = f.read()
+    samples, sample_rate = decode_wav(audio_data)
+    utterance_cache.put_video(cache_key, [{'start': 0.0, 'duration': len(samples) / sample_rate, 'video': video_data}])
+    if SOCKET_MEDIA_DELIVERY == "url":
+        return {'url': artifact_store.url(artifact_store.put_file(path, ".mp4"))}
+    return {'video': media_payload(video_data)}
+
+# Function to synthesize speech with voice_code; returns the WAV bytes
 async def synthesize_speech(text, voice_code=None, language="en-US"):
     speech_config.speech_synthesis_language = language
     if voice_code:
         speech_config.speech_synthesis_voice_name = voice_code
     
     synthesizer = SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-    result = synthesizer.speak_text_async(text).get()
+    # .get() blocks until Azure answers, so wait for it in a thread rather than on the event loop
+    result = await asyncio.to_thread(lambda: synthesizer.speak_text_async(text).get())
 
     if result.reason == ResultReason.SynthesizingAudioCompleted:
-        audio_data = result.audio_data
-        base64_audio = base64.b64encode(audio_data).decode('utf-8')
-        return base64_audio
+        return result.audio_data
     else:
         print(f"Speech synthesis failed with reason: {result.reason}")
         return None
 
-lip_sync_model = None
 # Azure Blob Storage configuration
 BLOB_CONNECTION_STRING = "DefaultEndpointsProtocol=https;AccountName=stmoliaihub774999322363;AccountKey=5zbHRn/VU9x4BlIz9ZH9ngZvGTyXjp0jB6pOXaLldGAMy1P4QTyRNP8g6/bC1gmN2xiCOQe+2Unm+AStUVApoA==;EndpointSuffix=core.windows.net"
 BLOB_CONTAINER_NAME = "lipsync-model"
@@ -76,9 +135,18 @@ def download_model_from_blob():
         print("Model already present locally.")
 
 
+def warm_up_lip_sync():
+    """Fetch the checkpoint, load it into the model registry and map the avatar bundles."""
+    download_model_from_blob()
+    preload_models(LOCAL_MODEL_PATH)
+    load_bundles(LOCAL_MODEL_PATH)
+    start_pool(LOCAL_MODEL_PATH)
 
 
-def get_voice_code_from_room_code(room_code):
+
+
+def get_avatar_from_room_code(room_code):
+    """Return (avatar_id, voice_code) for the session, or (None, None)."""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
@@ -89,16 +157,20 @@ def get_voice_code_from_room_code(room_code):
                 cursor.execute("SELECT voice_code FROM tbl_aiterp_Avatars WHERE avatar_id = ?", avatar_id)
                 avatar_result = cursor.fetchone()
                 if avatar_result:
-                    return avatar_result[0]
+                    return avatar_id, avatar_result[0]
                 else:
                     print(f"No avatar found with avatar_id: {avatar_id}")
-                    return None
+                    return None, None
             else:
                 print(f"No session found with session_id: {room_code}")
-                return None
+                return None, None
     except pyodbc.Error as e:
         print(f"Database error: {e}")
-        return None
+        return None, None
+
+
+def get_voice_code_from_room_code(room_code):
+    return get_avatar_from_room_code(room_code)[1]
 
 
 # Event handler when a new client connects
@@ -193,43 +265,121 @@ async def transcription(sid, data):
     await sio.emit('transcription', {'username': username, 'transcription': transcription}, room=room_code)
     print(f'Transcription from {username} in room {room_code}: {transcription}')
     
-    # Fetch the voice_code using the room_code (session_id)
-    voice_code = get_voice_code_from_room_code(room_code)
+    started = time.perf_counter()
+    # Fetch the avatar and voice_code using the room_code (session_id)
+    with metrics.stage("db_lookup"):
+        avatar_id, voice_code = get_avatar_from_room_code(room_code)
 
     if not voice_code:
         print(f"Voice code not found for room {room_code}")
         return
 
-    # Synthesize speech and get Base64-encoded audio
-    synthesized_audio = await synthesize_speech(transcription, voice_code, language)
-
-    if synthesized_audio:
-        # Decode Base64 audio to raw bytes
-        audio_data = base64.b64decode(synthesized_audio)
-
-        # Save synthesized audio to a temporary file
-        audio_path = f"static/output/{room_code}_synthesized.wav"
-        with open(audio_path, "wb") as f:
-            f.write(audio_data)
-
-        # Use a pre-recorded video for lip-sync
-        image_path = f"static/faces/es.jpg"
-        output_video_path = f"static/output/{room_code}_result.mp4"
+    # Use the avatar's precomputed bundle, falling back to the default face
+    image_path = f"static/faces/es.jpg"
+    # A unique path per utterance, so concurrent utterances in one room never share a file
+    output_video_path = artifact_store.temp_path(".mp4")
+
+    # Repeated phrases skip TTS and rendering when the utterance is cached; cache reads and
+    # writes hit the disk, so they run in a thread to keep other rooms responsive
+    cache_key = utterance_cache_key(transcription, language, voice_code, avatar_id, image_path)
+    cached = await asyncio.to_thread(utterance_cache.get, cache_key)
+    if cached is not None and cached.segments and (LIPSYNC_STREAMING or len(cached.segments) == 1):
+        await emit_cached_video(room_code, username, cached.segments)
+        metrics.transcription_seconds.observe(time.perf_counter() - started, outcome="cached")
+        return
 
-        # Generate lip-synced video
+    # Synthesize speech as WAV bytes; they are parsed in memory, not written to disk
+    if cached is not None:
+        audio_data = cached.audio
+    else:
+        with metrics.stage("tts"):
+            audio_data = await synthesize_speech(transcription, voice_code, language)
+        if audio_data:
+            await asyncio.to_thread(utterance_cache.put_audio, cache_key, audio_data)
+
+    if audio_data:
+        # Generate lip-synced video in the worker pool so other rooms stay responsive
+        if LIPSYNC_STREAMING:
+            streamed = await stream_lip_sync_to_room(sid, room_code, username, image_path, audio_data, avatar_id, cache_key)
+            metrics.transcription_seconds.observe(time.perf_counter() - started, outcome="streamed" if streamed else "failed")
+            return
         try:
-            generate_lip_sync(image_path, audio_path, LOCAL_MODEL_PATH, output_video_path)
-            with open(output_video_path, "rb") as f:
-                video_data = f.read()
-                base64_video = base64.b64encode(video_data).decode('utf-8')
+            await run_lip_sync(image_path, audio_data, LOCAL_MODEL_PATH, output_video_path, avatar_id=avatar_id)
+            video = await asyncio.to_thread(store_rendered_video, cache_key, output_video_path, audio_data)
 
-            await sio.emit('lipSyncComplete', {'username': username, 'video': base64_video}, room=room_code)
+            await emit_video('lipSyncComplete', {'username': username, **video}, None, room_code)
+            metrics.transcription_seconds.observe(time.perf_counter() - started, outcome="complete")
             print(f"Lip-synced video generated for room {room_code} and sent to clients.")
         except Exception as e:
+            metrics.transcription_seconds.observe(time.perf_counter() - started, outcome="failed")
             print(f"Lip-sync generation failed: {e}")
             await sio.emit('error', {'message': 'Failed to generate lip-synced video.'}, to=sid)
-
-
+        finally:
+            # Already gone once put_file has moved it into the store
+            if os.path.exists(output_video_path):
+                os.remove(output_video_path)
+
+
+
+def utterance_cache_key(text, language, voice_code, avatar_id, image_path):
+    """Cache key covering the text, voice, the avatar image actually rendered and its checkpoint."""
+    bundle = get_bundle(avatar_id) if avatar_id is not None else None
+    avatar = f"{avatar_id}:{bundle.meta.get('avatar_img')}" if bundle is not None else file_id(image_path)
+    checkpoint = checkpoint_for_avatar(avatar_id, LOCAL_MODEL_PATH)
+    return utterance_key(text, language, voice_code, avatar, checkpoint_id(checkpoint))
+
+def checkpoint_id(checkpoint):
+    """`file_id` of the checkpoint's files, so a re-exported model gets new cache keys.
+
+    An ONNX checkpoint name stands for the encoder and decoder files its export writes.
+    """
+    paths = onnx_paths(checkpoint) if checkpoint.endswith(".onnx") else (checkpoint,)
+    if not all(os.path.exists(path) for path in paths):
+        return checkpoint
+    return ",".join(file_id(path) for path in paths)
+
+async def emit_cached_video(room_code, username, segments):
+    """Replay a cached video with the same events a fresh render would send."""
+    if not LIPSYNC_STREAMING:
+        await emit_video('lipSyncComplete', {'username': username}, segments[0]['video'], room_code)
+    else:
+        for index, segment in enumerate(segments):
+            await emit_video('lipSyncChunk', {
+                'username': username,
+                'index': index,
+                'start': segment['start'],
+                'duration': segment['duration'],
+            }, segment['video'], room_code)
+        await sio.emit('lipSyncEnd', {'username': username, 'segments': len(segments)}, room=room_code)
+    print(f"Served cached lip-sync video to room {room_code}.")
+
+async def stream_lip_sync_to_room(sid, room_code, username, image_path, audio_data, avatar_id, cache_key=None):
+    """Forward each rendered segment as lipSyncChunk, then lipSyncEnd once the video is complete.
+
+    Returns False if the render failed.
+    """
+    index = -1
+    segments = []
+    try:
+        async for segment in stream_lip_sync(image_path, audio_data, LOCAL_MODEL_PATH, avatar_id=avatar_id):
+            index = segment['index']
+            segments.append(segment)
+            await emit_video('lipSyncChunk', {
+                'username': username,
+                'index': index,
+                'start': segment['start'],
+                'duration': segment['duration'],
+            }, segment['video'], room_code)
+        await sio.emit('lipSyncEnd', {'username': username, 'segments': index + 1}, room=room_code)
+        if cache_key is not None:
+            await asyncio.to_thread(utterance_cache.put_video, cache_key, segments)
+        print(f"Streamed {index + 1} lip-sync segments to room {room_code}.")
+        return True
+    except Exception as e:
+        print(f"Lip-sync generation failed: {e}")
+        await sio.emit('lipSyncEnd', {'username': username, 'segments': index + 1, 'error': True}, room=room_code)
+        await sio.emit('error', {'message': 'Failed to generate lip-synced video.'}, to=sid)
+        return False
 
 # Event handler for when a client leaves a room
 @sio.event
@@ -0,0 +1,225 @@
+"""Content-addressed cache of synthesized utterances.
+
+Interpreters repeat stock phrases, so the TTS audio and the rendered
+lip-sync video are cached under a hash of everything that determines them:
+text, language, voice, avatar image and Wav2Lip checkpoint. Entries live in
+a small in-memory LRU backed by a larger on-disk LRU store; both are bounded
+by size.
+
+Configuration (environment variables):
+    UTTERANCE_CACHE_DIR        on-disk store (default static/cache/utterances)
+    UTTERANCE_CACHE_MEMORY_MB  in-memory budget (default 64)
+    UTTERANCE_CACHE_DISK_MB    on-disk budget (default 1024)
+
+Each disk entry is a directory holding audio.wav, the video segments and a
+segments.json index written last, so a half-written entry only counts as audio.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from router import metrics
+
+UTTERANCE_CACHE_DIR = os.getenv("UTTERANCE_CACHE_DIR", "static/cache/utterances")
+UTTERANCE_CACHE_MEMORY_MB = float(os.getenv("UTTERANCE_CACHE_MEMORY_MB", "64"))
+UTTERANCE_CACHE_DISK_MB = float(os.getenv("UTTERANCE_CACHE_DISK_MB", "1024"))
+
+
+def utterance_key(text, language, voice_code, avatar, checkpoint):
+    """sha256 over the inputs that determine an utterance; whitespace in `text` is normalized."""
+    fields = [" ".join(text.split()), language, voice_code, avatar, checkpoint]
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+
+def file_id(path):
+    """Identify a file (avatar image, checkpoint) by name, size and modification time."""
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class CachedUtterance:
+    """Synthesized WAV bytes plus, once rendered, the video segments.
+
+    `segments` is a list of dicts with `start`, `duration` (seconds) and
+    `video` (MP4 bytes), in the shape produced by `generate_lip_sync_stream`;
+    a non-streamed video is a single segment.
+    """
+    def __init__(self, audio, segments=None):
+        self.audio = audio
+        self.segments = segments
+
+    @property
+    def nbytes(self):
+        return len(self.audio) + sum(len(s["video"]) for s in self.segments or [])
+
+
+class UtteranceCache:
+    """Two-level LRU cache of `CachedUtterance` entries keyed by `utterance_key`."""
+
+    def __init__(self, directory=UTTERANCE_CACHE_DIR, memory_bytes=UTTERANCE_CACHE_MEMORY_MB * 1024 ** 2,
+                 disk_bytes=UTTERANCE_CACHE_DISK_MB * 1024 ** 2):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> entry size, least recently used first
+        self._disk_size = 0
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "audio_hits": 0, "misses": 0}
+        self._scan_disk()
+
+    def _scan_disk(self):
+        """Index existing entries, oldest access first, so the LRU order survives restarts."""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if os.path.isdir(path):
+                entries.append((os.path.getmtime(path), key, self._entry_size(path)))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    @staticmethod
+    def _entry_size(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """The cached utterance for `key`, or None. Entries without video count as audio hits."""
+        with self._lock:
+            level = "memory"
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                level = "disk"
+                entry = self._read_disk(key)
+                if entry is not None:
+                    self._remember(key, entry)
+
+            if entry is None:
+                self._counts["misses"] += 1
+            elif entry.segments is None:
+                self._counts["audio_hits"] += 1
+            else:
+                self._counts[level + "_hits"] += 1
+            return entry
+
+    def put_audio(self, key, audio):
+        """Cache synthesized speech before its video is rendered."""
+        with self._lock:
+            entry = CachedUtterance(bytes(audio))
+            path = self._path(key)
+            os.makedirs(path, exist_ok=True)
+            self._write_file(os.path.join(path, "audio.wav"), entry.audio)
+            self._remember(key, entry)
+            self._account_disk(key)
+
+    def put_video(self, key, segments):
+        """Attach rendered video segments to the entry for `key` (its audio must be cached)."""
+        with self._lock:
+            entry = self._memory.get(key) or self._read_disk(key)
+            if entry is None:
+                return
+            entry = CachedUtterance(entry.audio, [dict(s, video=bytes(s["video"])) for s in segments])
+            path = self._path(key)
+            os.makedirs(path, exist_ok=True)
+            self._write_file(os.path.join(path, "audio.wav"), entry.audio)
+            index = []
+            for i, segment in enumerate(entry.segments):
+                name = f"segment_{i:03d}.mp4"
+                self._write_file(os.path.join(path, name), segment["video"])
+                index.append({"file": name, "start": segment["start"], "duration": segment["duration"]})
+            self._write_file(os.path.join(path, "segments.json"), json.dumps(index).encode("utf-8"))
+            self._remember(key, entry)
+            self._account_disk(key)
+
+    def _read_disk(self, key):
+        if key not in self._disk:
+            return None
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, "audio.wav"), "rb") as f:
+                audio = f.read()
+            segments = None
+            index_path = os.path.join(path, "segments.json")
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    index = json.load(f)
+                segments = []
+                for item in index:
+                    with open(os.path.join(path, item["file"]), "rb") as f:
+                        segments.append({"start": item["start"], "duration": item["duration"], "video": f.read()})
+        except OSError as e:
+            print(f"Dropping unreadable utterance cache entry {key}: {e}")
+            self._drop_disk(key)
+            return None
+        # Bump the directory mtime so the LRU order is kept across restarts
+        now = time.time()
+        os.utime(path, (now, now))
+        self._disk.move_to_end(key)
+        return CachedUtterance(audio, segments)
+
+    @staticmethod
+    def _write_file(path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remember(self, key, entry):
+        """Insert into the memory LRU, evicting least recently used entries over budget."""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= old.nbytes
+        if entry.nbytes > self.memory_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_size += entry.nbytes
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= evicted.nbytes
+
+    def _account_disk(self, key):
+        """Refresh the size of `key` on disk and evict least recently used entries over budget."""
+        self._disk_size -= self._disk.pop(key, 0)
+        size = self._entry_size(self._path(key))
+        self._disk[key] = size
+        self._disk_size += size
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            oldest = next(iter(self._disk))
+            self._drop_disk(oldest)
+
+    def _drop_disk(self, key):
+        self._disk_size -= self._disk.pop(key, 0)
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def stats(self):
+        """Hit/miss counters, hit rate and the size of both levels."""
+        with self._lock:
+            counts = dict(self._counts)
+            lookups = sum(counts.values())
+            full_hits = counts["memory_hits"] + counts["disk_hits"]
+            return dict(counts,
+                        lookups=lookups,
+                        hit_rate=full_hits / lookups if lookups else 0.0,
+                        memory_entries=len(self._memory), memory_bytes=self._memory_size,
+                        disk_entries=len(self._disk), disk_bytes=self._disk_size)
+
+
+cache = UtteranceCache()
+
+metrics.Callback("lipsync_utterance_cache_lookups_total", "Utterance cache lookups by result.",
+                 lambda: {result: cache.stats()[count] for result, count in
+                          (("memory", "memory_hits"), ("disk", "disk_hits"), ("audio", "audio_hits"), ("miss", "misses"))},
+                 ["result"], kind="counter")
+metrics.Callback("lipsync_utterance_cache_bytes", "Size of the utterance cache levels.",
+                 lambda: {level: cache.stats()[level + "_bytes"] for level in ("memory", "disk")}, ["level"])